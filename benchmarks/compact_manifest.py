@@ -0,0 +1,120 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""
+Memory taken by a Manifest and a CompactManifest of many entries
+
+Each structure is built in a fresh interpreter, which reports how much its
+resident set grew, both for sections built one by one as JarExtractor does
+and for a manifest parsed from text.
+
+    python benchmarks/compact_manifest.py [--entries 50000]
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import synth
+
+from signing_clients.apps import (
+    CompactManifest,
+    DEFAULT_ALGORITHMS,
+    Manifest,
+    Section,
+    _digest
+)
+
+PAGE_SIZE = resource.getpagesize()
+
+
+def rss():
+    # Current, not peak, resident set size; Linux only
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def entries(count):
+    for i in xrange(count):
+        yield ('content/dir-%d/file-%d.js' % (i % 64, i),
+               _digest(str(i), DEFAULT_ALGORITHMS))
+
+
+def build_list(count, text):
+    return Manifest(Section(name, algos=DEFAULT_ALGORITHMS, digests=digests)
+                    for name, digests in entries(count))
+
+
+def build_compact(count, text):
+    manifest = CompactManifest(DEFAULT_ALGORITHMS)
+    for name, digests in entries(count):
+        manifest.append(name, digests)
+    return manifest
+
+
+def parse_list(count, text):
+    return Manifest.parse(text)
+
+
+def parse_compact(count, text):
+    return CompactManifest.parse(text)
+
+
+MODES = ['build_list', 'build_compact', 'parse_list', 'parse_compact']
+
+
+def child(mode, count, path):
+    with open(path, 'rb') as f:
+        text = f.read()
+    before = rss()
+    start = time.time()
+    manifest = globals()[mode](count, text)
+    elapsed = time.time() - start
+    grown = rss() - before
+    start = time.time()
+    assert len(str(manifest)) == len(text)
+    serialize = time.time() - start
+    print json.dumps({'bytes': grown, 'seconds': elapsed,
+                      'serialize': serialize})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child[0], int(args.child[1]), args.child[2])
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-compact-manifest-')
+    try:
+        path = os.path.join(tmpdir, 'manifest.mf')
+        with open(path, 'wb') as f:
+            f.write(str(build_list(args.entries, None)))
+        print '%d entries, %.1f MB of manifest text' % (
+            args.entries, os.path.getsize(path) / float(synth.MB))
+        print '%-14s %10s %12s %10s %10s' % ('mode', 'MB', 'bytes/entry',
+                                             'build', 'serialize')
+        for mode in MODES:
+            out = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__),
+                 '--child', mode, str(args.entries), path])
+            result = json.loads(out.strip().splitlines()[-1])
+            print '%-14s %10.1f %12.0f %10.3f %10.3f' % (
+                mode, result['bytes'] / float(synth.MB),
+                result['bytes'] / float(args.entries), result['seconds'],
+                result['serialize'])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""
+CPU time and output size of make_signed() for each compression policy
+
+The synthetic add-on mixes compressible scripts with incompressible images
+and a couple of large binary blobs, roughly in the proportions of the add-ons
+in the wild.
+
+    python benchmarks/compression_policy.py [--scripts 2000] [--images 500]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import synth
+
+from signing_clients import compression
+from signing_clients.apps import JarExtractor
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scripts', type=int, default=2000)
+    parser.add_argument('--images', type=int, default=500)
+    parser.add_argument('--blobs', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-compression-policy-')
+    try:
+        path = synth.make_xpi(os.path.join(tmpdir, 'addon.xpi'),
+                              small_files=args.scripts, small_size=4096,
+                              images=args.images, large_files=args.blobs,
+                              large_size=4 * synth.MB)
+        print 'archive: %.1f MB' % (os.path.getsize(path) / float(synth.MB))
+        extracted = JarExtractor(path)
+        extracted.signatures_text
+        policies = [
+            ('writestr (default)', {}),
+            ('raw_copy', {'raw_copy': True}),
+            ('KEEP', {'compression': compression.CompressionPolicy()}),
+            ('FAST', {'compression': compression.FAST}),
+            ('STORE', {'compression': compression.CompressionPolicy(
+                default=compression.STORE)}),
+            ('MAX_RATIO', {'compression': compression.MAX_RATIO}),
+        ]
+        outpath = os.path.join(tmpdir, 'signed.xpi')
+        print '%-20s %10s %10s %10s' % ('policy', 'cpu s', 'wall s',
+                                        'size MB')
+        for label, kwargs in policies:
+            cpu = wall = None
+            for _ in range(args.repeat):
+                if os.path.exists(outpath):
+                    os.unlink(outpath)
+                start, start_cpu = time.time(), cpu_time()
+                extracted.make_signed('', outpath, sigpath='zigbert',
+                                      **kwargs)
+                elapsed = time.time() - start
+                used = cpu_time() - start_cpu
+                wall = elapsed if wall is None else min(wall, elapsed)
+                cpu = used if cpu is None else min(cpu, used)
+            print '%-20s %10.3f %10.3f %10.2f' % (
+                label, cpu, wall, os.path.getsize(outpath) / float(synth.MB))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
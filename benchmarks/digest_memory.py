@@ -0,0 +1,73 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""
+Peak RSS of JarExtractor on a synthetic multi-hundred-MB XPI
+
+Each measurement runs in a fresh interpreter so that ru_maxrss only reflects
+the extraction being measured.  A chunk size larger than the biggest member
+reproduces the old whole-member reads.
+
+    python benchmarks/digest_memory.py [--size-mb 400] [--files 4]
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import synth
+
+
+def child(path, chunk_size):
+    from signing_clients.apps import JarExtractor
+    start = time.time()
+    JarExtractor(path, chunk_size=chunk_size)
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%d %f' % (peak, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size-mb', type=int, default=400,
+                        help='total size of the large members')
+    parser.add_argument('--files', type=int, default=4,
+                        help='number of large members')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child[0], int(args.child[1]))
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-digest-memory-')
+    try:
+        member_size = args.size_mb * synth.MB // args.files
+        path = synth.make_xpi(os.path.join(tmpdir, 'big.xpi'),
+                              small_files=200, large_files=args.files,
+                              large_size=member_size)
+        print 'archive: %d MB, %d members of %d MB' % (
+            os.path.getsize(path) // synth.MB, args.files,
+            member_size // synth.MB)
+        print '%-16s %12s %10s' % ('chunk size', 'peak RSS MB', 'seconds')
+        sizes = [(str(1 << n), 1 << n) for n in (12, 16, 20, 24)]
+        sizes.append(('whole member', member_size + 1))
+        for label, chunk_size in sizes:
+            out = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__),
+                 '--child', path, str(chunk_size)])
+            peak, elapsed = out.split()
+            print '%-16s %12.1f %10.2f' % (label, int(peak) / 1024.0,
+                                           float(elapsed))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""
+Manifest.parse throughput on a large synthetic manifest, and the cost of
+indexing the same manifest with LazyManifest
+
+    python benchmarks/manifest_parse.py [--sections 20000]
+"""
+
+import argparse
+import hashlib
+import time
+
+import synth  # noqa (sets up sys.path)
+
+from signing_clients.apps import LazyManifest, Manifest, Section, _digest
+
+
+def make_manifest(sections):
+    items = []
+    for i in xrange(sections):
+        # Every fourth name is long enough to need continuation lines
+        if i % 4:
+            name = 'content/dir-%d/file-%d.js' % (i % 64, i)
+        else:
+            name = '/'.join(['nested-test-dir-%d' % d for d in range(6)])
+            name += '/long-path-name-test-%d.js' % i
+        items.append(Section(name, digests=_digest(hashlib.md5(name).digest())))
+    return str(Manifest(items))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sections', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    text = make_manifest(args.sections)
+    print 'sections: %d, manifest: %.1f MB' % (args.sections,
+                                               len(text) / 1048576.0)
+    for label, func in [('Manifest.parse', Manifest.parse),
+                        ('LazyManifest', LazyManifest)]:
+        best = None
+        for _ in range(args.repeat):
+            start = time.time()
+            parsed = func(text)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        assert len(parsed) == args.sections
+        print '%-16s best of %d: %.3f s, %.0f sections/s, %.1f MB/s' % (
+            label, args.repeat, best, args.sections / best,
+            len(text) / 1048576.0 / best)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""
+JarExtractor and make_signed with and without memory_map
+
+Runs on a stored and a deflated synthetic XPI, since stored members are the
+ones hashed straight from the mapping with no copies at all.
+
+    python benchmarks/mmap_input.py [--files 2000] [--size 65536]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+import synth
+
+from signing_clients.apps import JarExtractor
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=64 * 1024,
+                        help='uncompressed size of each member in bytes')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-mmap-input-')
+    try:
+        print '%-10s %-10s %10s %10s' % ('archive', 'mode', 'extract',
+                                         'raw copy')
+        for label, compression in (('stored', zipfile.ZIP_STORED),
+                                   ('deflated', zipfile.ZIP_DEFLATED)):
+            path = synth.make_xpi(os.path.join(tmpdir, label + '.xpi'),
+                                  small_files=args.files,
+                                  small_size=args.size,
+                                  compression=compression)
+            outpath = os.path.join(tmpdir, 'signed.xpi')
+            for memory_map in (False, True):
+                extract = best_of(args.repeat, lambda: JarExtractor(
+                    path, memory_map=memory_map))
+                extracted = JarExtractor(path, memory_map=memory_map)
+
+                def copy():
+                    if os.path.exists(outpath):
+                        os.unlink(outpath)
+                    extracted.make_signed('', outpath, sigpath='zigbert',
+                                          raw_copy=True)
+                print '%-10s %-10s %10.3f %10.3f' % (
+                    label, 'mmap' if memory_map else 'read', extract,
+                    best_of(args.repeat, copy))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""
+Wall clock time of JarExtractor against worker count on a 5,000 file XPI
+
+    python benchmarks/parallel_digest.py [--files 5000] [--size 32768]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import synth
+
+from signing_clients.apps import JarExtractor
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=32 * 1024,
+                        help='uncompressed size of each member in bytes')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-parallel-digest-')
+    try:
+        path = synth.make_xpi(os.path.join(tmpdir, 'many.xpi'),
+                              small_files=args.files, small_size=args.size)
+        print 'archive: %d members, %.1f MB' % (
+            args.files, os.path.getsize(path) / float(synth.MB))
+        print '%-8s %-8s %10s %8s' % ('backend', 'workers', 'seconds',
+                                      'speedup')
+        baseline = best_of(args.repeat, lambda: JarExtractor(path))
+        print '%-8s %-8s %10.3f %8.2f' % ('serial', 1, baseline, 1.0)
+        for backend in ('thread', 'process'):
+            for workers in args.workers:
+                if workers < 2:
+                    continue
+                elapsed = best_of(args.repeat, lambda: JarExtractor(
+                    path, workers=workers, backend=backend))
+                print '%-8s %-8d %10.3f %8.2f' % (backend, workers, elapsed,
+                                                  baseline / elapsed)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""
+Signatures per second: JarSigner.sign_many() against calling sign() in a
+loop, against loading the key and chain for every signature and against a
+SigningPool of worker processes
+
+    python benchmarks/sign_throughput.py [--count 500]
+"""
+
+import argparse
+import os
+import time
+
+import synth  # noqa (sets up sys.path)
+
+from M2Crypto import EVP, X509
+from M2Crypto.BIO import MemoryBuffer
+
+from signing_clients.apps import JarSigner
+from signing_clients.pool import SigningPool
+
+TESTS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'signing_clients', 'tests')
+KEY = os.path.join(TESTS, 'test-signer.key.pem')
+CERT = os.path.join(TESTS, 'test-signer.cert.pem')
+
+
+def load_signer():
+    chain = X509.X509_Stack()
+    chain.push(X509.load_cert(CERT))
+    return JarSigner(EVP.load_key(KEY), chain)
+
+
+def payloads(count):
+    return ['Signature-Version: 1.0\nSHA1-Digest-Manifest: %028d\n' % i
+            for i in xrange(count)]
+
+
+def fresh_signer_per_item(items):
+    for data in items:
+        load_signer().sign_der(data)
+
+
+def sign_loop(items):
+    signer = load_signer()
+    for data in items:
+        buf = MemoryBuffer()
+        signer.sign(data).write_der(buf)
+        buf.read()
+
+
+def sign_many(items):
+    load_signer().sign_many(items)
+
+
+def pool_sign_many(items, processes=None):
+    with open(KEY) as f:
+        key_pem = f.read()
+    with open(CERT) as f:
+        chain_pem = f.read()
+    with SigningPool(key_pem, chain_pem, processes=processes) as pool:
+        pool.sign_many(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=500)
+    args = parser.parse_args()
+    items = payloads(args.count)
+    print '%-24s %12s' % ('mode', 'sigs/sec')
+    for name, func in [('load key per signature', fresh_signer_per_item),
+                       ('sign() loop', sign_loop),
+                       ('sign_many()', sign_many),
+                       ('SigningPool.sign_many()', pool_sign_many)]:
+        start = time.time()
+        func(items)
+        elapsed = time.time() - start
+        print '%-24s %12.1f' % (name, args.count / elapsed)
+
+
+if __name__ == '__main__':
+    main()
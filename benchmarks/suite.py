@@ -0,0 +1,245 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""
+Times every stage of the signing path on a set of synthetic XPIs
+
+Each stage runs on each archive in a fresh interpreter, so the peak RSS
+reported is that of the stage (plus its untimed setup) alone.  Results are
+written as JSON, and a previous run can be given to compare against:
+
+    python benchmarks/suite.py --output before.json
+    python benchmarks/suite.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import synth
+
+from signing_clients.apps import JarExtractor, ZipFile
+
+TESTS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'signing_clients', 'tests')
+KEY = os.path.join(TESTS, 'test-signer.key.pem')
+CERT = os.path.join(TESTS, 'test-signer.cert.pem')
+
+# Keyword arguments for synth.make_xpi(); member counts are multiplied by
+# --scale
+ARCHIVES = {
+    'tiny-files': dict(small_files=5000, small_size=512),
+    'huge-files': dict(large_files=2, large_size=32 * synth.MB),
+    'deep-paths': dict(deep_paths=2000),
+    'unicode-names': dict(unicode_names=2000),
+}
+
+STAGES = ['extract', 'parse', 'serialize', 'sign', 'make_signed',
+          'serial_number']
+
+
+def load_signer():
+    from M2Crypto import EVP, X509
+    from signing_clients.apps import JarSigner
+    chain = X509.X509_Stack()
+    chain.push(X509.load_cert(CERT))
+    return JarSigner(EVP.load_key(KEY), chain)
+
+
+def read(fixture, name):
+    with open(os.path.join(fixture, name), 'rb') as f:
+        return f.read()
+
+
+def stage_extract(fixture):
+    path = os.path.join(fixture, 'archive.xpi')
+    return lambda: JarExtractor(path)
+
+
+def stage_parse(fixture):
+    from signing_clients.apps import Manifest
+    text = read(fixture, 'manifest.mf')
+    return lambda: Manifest.parse(text)
+
+
+def stage_serialize(fixture):
+    extracted = JarExtractor(os.path.join(fixture, 'archive.xpi'))
+    sections = list(extracted.manifest)
+
+    def serialize():
+        # A new extractor state each time, so nothing is cached
+        extracted._manifest = extracted._manifest_text = None
+        extracted._sig = extracted._sig_text = None
+        extracted._digests = sections
+        extracted.manifest_text
+        extracted.signatures_text
+    return serialize
+
+
+def stage_sign(fixture):
+    signer = load_signer()
+    data = read(fixture, 'zigbert.sf')
+    return lambda: signer.sign(data)
+
+
+def stage_make_signed(fixture):
+    extracted = JarExtractor(os.path.join(fixture, 'archive.xpi'))
+    extracted.signatures_text
+    signature = read(fixture, 'zigbert.rsa')
+    outpath = os.path.join(fixture, 'signed.xpi')
+
+    def make_signed():
+        if os.path.exists(outpath):
+            os.unlink(outpath)
+        extracted.make_signed(signature, outpath, sigpath='zigbert')
+    return make_signed
+
+
+def stage_serial_number(fixture):
+    from signing_clients.apps import SignatureInfo
+    signature = read(fixture, 'zigbert.rsa')
+    # get_signature_serial_number() would answer every run after the first
+    # from its cache.  One untimed run imports M2Crypto.
+    SignatureInfo(signature)
+    return lambda: SignatureInfo(signature).serial_number
+
+
+def child(stage, fixture, repeat):
+    func = globals()['stage_' + stage](fixture)
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print json.dumps({'seconds': best, 'peak_rss_kb': peak})
+
+
+def make_fixture(fixture, spec, scale):
+    os.mkdir(fixture)
+    kwargs = dict((key, value if key.endswith('_size') else value * scale)
+                  for key, value in spec.iteritems())
+    path = synth.make_xpi(os.path.join(fixture, 'archive.xpi'), **kwargs)
+    extracted = JarExtractor(path)
+    with open(os.path.join(fixture, 'manifest.mf'), 'wb') as f:
+        f.write(extracted.manifest_text)
+    with open(os.path.join(fixture, 'zigbert.sf'), 'wb') as f:
+        f.write(extracted.signatures_text)
+    with open(os.path.join(fixture, 'zigbert.rsa'), 'wb') as f:
+        f.write(load_signer().sign_der(extracted.signatures_text))
+    with ZipFile(path, 'r') as zin:
+        members = [f for f in zin.infolist() if not f.filename.endswith('/')]
+    return {
+        'members': len(members),
+        'archive_bytes': os.path.getsize(path),
+        'content_bytes': sum(f.file_size for f in members),
+        'manifest_bytes': len(extracted.manifest_text),
+    }
+
+
+def throughput(stage, info, seconds):
+    """
+    Returns (items, bytes) processed per second by a stage
+    """
+    seconds = max(seconds, 1e-9)
+    if stage in ('extract', 'make_signed'):
+        return info['members'] / seconds, info['content_bytes'] / seconds
+    if stage in ('parse', 'serialize'):
+        return info['members'] / seconds, info['manifest_bytes'] / seconds
+    return 1 / seconds, None
+
+
+def compare(results, baseline):
+    print
+    print '%-28s %10s %10s %8s %10s %10s' % (
+        'vs baseline', 'seconds', 'before', 'ratio', 'peak MB', 'before')
+    for key in sorted(results):
+        now, then = results[key], baseline.get(key, {})
+        if 'seconds' not in now or 'seconds' not in then:
+            continue
+        print '%-28s %10.4f %10.4f %8.2f %10.1f %10.1f' % (
+            key, now['seconds'], then['seconds'],
+            now['seconds'] / max(then['seconds'], 1e-9),
+            now['peak_rss_kb'] / 1024.0, then['peak_rss_kb'] / 1024.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--archives', nargs='+', choices=sorted(ARCHIVES),
+                        default=sorted(ARCHIVES))
+    parser.add_argument('--stages', nargs='+', choices=STAGES,
+                        default=STAGES)
+    parser.add_argument('--scale', type=int, default=1,
+                        help='multiplies the number of members')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child[0], args.child[1], int(args.child[2]))
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-suite-')
+    results = {}
+    try:
+        print '%-28s %10s %12s %10s %10s' % ('archive/stage', 'seconds',
+                                              'items/s', 'MB/s', 'peak MB')
+        for name in args.archives:
+            fixture = os.path.join(tmpdir, name)
+            info = make_fixture(fixture, ARCHIVES[name], args.scale)
+            for stage in args.stages:
+                key = '%s/%s' % (name, stage)
+                try:
+                    out = subprocess.check_output(
+                        [sys.executable, os.path.abspath(__file__),
+                         '--child', stage, fixture, str(args.repeat)],
+                        stderr=subprocess.STDOUT)
+                except subprocess.CalledProcessError as e:
+                    # Keep going, so one broken stage still leaves numbers
+                    # for all the others
+                    error = e.output.strip().splitlines()[-1]
+                    results[key] = {'error': error}
+                    print '%-28s failed: %s' % (key, error)
+                    continue
+                result = json.loads(out.strip().splitlines()[-1])
+                items, nbytes = throughput(stage, info, result['seconds'])
+                result.update(info)
+                result['items_per_sec'] = items
+                result['bytes_per_sec'] = nbytes
+                results[key] = result
+                print '%-28s %10.4f %12.1f %10s %10.1f' % (
+                    key, result['seconds'], items,
+                    '%.1f' % (nbytes / synth.MB) if nbytes else '-',
+                    result['peak_rss_kb'] / 1024.0)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""
+Generators for the synthetic XPIs used by the benchmark scripts in this
+directory.
+"""
+
+import os
+import sys
+import tempfile
+import zipfile
+
+# Make the benchmarks runnable straight out of a source checkout
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MB = 1024 * 1024
+
+
+def _write_large(zout, arcname, size, tmpdir):
+    # ZipFile.writestr() needs the whole member in memory, so large members
+    # are staged on disk first and streamed into the archive with write()
+    fd, staging = tempfile.mkstemp(dir=tmpdir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            remaining = size
+            while remaining:
+                chunk = min(remaining, MB)
+                f.write(os.urandom(chunk))
+                remaining -= chunk
+        zout.write(staging, arcname)
+    finally:
+        os.unlink(staging)
+
+
+def make_xpi(path, small_files=0, small_size=512, large_files=0,
+             large_size=0, deep_paths=0, unicode_names=0, images=0,
+             image_size=16 * 1024, compression=zipfile.ZIP_DEFLATED):
+    """
+    Writes a synthetic XPI to path and returns path
+
+    The large members are random and so effectively incompressible, like the
+    wasm blobs, fonts and dictionaries that real add-ons bundle.  So are the
+    images, which stand in for the PNG icons and skins most add-ons have.
+    """
+    tmpdir = os.path.dirname(os.path.abspath(path))
+    with zipfile.ZipFile(path, 'w', compression, allowZip64=True) as zout:
+        zout.writestr('install.rdf', '<?xml version="1.0"?>\n<RDF/>\n')
+        zout.writestr('chrome.manifest', 'content synth content/\n')
+        for i in xrange(small_files):
+            zout.writestr('content/dir-%d/file-%d.js' % (i % 64, i),
+                          ('// synthetic file %d\n' % i) * (small_size // 24))
+        for i in xrange(large_files):
+            _write_large(zout, 'data/blob-%d.bin' % i, large_size, tmpdir)
+        for i in xrange(deep_paths):
+            name = '/'.join(['nested-test-dir-%d' % d for d in range(8)])
+            zout.writestr('%s/long-path-name-test-%d' % (name, i),
+                          'deep file %d\n' % i)
+        for i in xrange(images):
+            zout.writestr('skin/image-%d.png' % i, os.urandom(image_size))
+        for i in xrange(unicode_names):
+            zout.writestr(u'locale/s\xfai\xe9t\xe9-h\xf6\xf1e-%d.txt' % i,
+                          'unicode file %d\n' % i)
+    return path
@@ -24,5 +24,10 @@ setup(name='signing_clients',
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
-    test_suite='signing_clients.tests'
+    test_suite='signing_clients.tests',
+    entry_points={
+        'console_scripts': [
+            'sign-xpis = signing_clients.cli:main',
+        ],
+    }
 )
@@ -4,21 +4,73 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 # ***** END LICENSE BLOCK *****
 
+import array
+import collections
+import copy
+import datetime
 import fnmatch
+import functools
 import hashlib
+import importlib
 import itertools
+import mmap
+import multiprocessing
 import os.path
 import re
+import struct
+import sys
+import tempfile
+import threading
+import types
 import zipfile
+import zlib
 
 from base64 import b64encode, b64decode
 from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
 
-from M2Crypto import Err
-from M2Crypto.BIO import BIOError, MemoryBuffer
-from M2Crypto.SMIME import SMIME, PKCS7, PKCS7_DETACHED, PKCS7_BINARY
-from M2Crypto.X509 import X509_Stack
-from M2Crypto.m2 import pkcs7_read_bio_der
+from signing_clients.compression import KEEP, STORE
+from signing_clients.metrics import NULL_METRICS
+
+
+class _LazyModule(object):
+    """
+    Stands in for the module name, which is only imported when one of its
+    attributes is first looked up
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# M2Crypto, and with it OpenSSL, is only loaded once something signs or
+# reads a signature, so that tools which only deal in manifests start fast
+BIO = _LazyModule('M2Crypto.BIO')
+Err = _LazyModule('M2Crypto.Err')
+EVP = _LazyModule('M2Crypto.EVP')
+_SMIME = _LazyModule('M2Crypto.SMIME')
+X509 = _LazyModule('M2Crypto.X509')
+m2 = _LazyModule('M2Crypto.m2')
+
+# What this module imported from M2Crypto before it was loaded lazily:
+# name -> (module, attribute).  They can still be imported from here, see
+# _LazyNamesModule.
+_M2CRYPTO_NAMES = {
+    'BIOError': ('M2Crypto.BIO', 'BIOError'),
+    'MemoryBuffer': ('M2Crypto.BIO', 'MemoryBuffer'),
+    'SMIME': ('M2Crypto.SMIME', 'SMIME'),
+    'PKCS7': ('M2Crypto.SMIME', 'PKCS7'),
+    'PKCS7_DETACHED': ('M2Crypto.SMIME', 'PKCS7_DETACHED'),
+    'PKCS7_BINARY': ('M2Crypto.SMIME', 'PKCS7_BINARY'),
+    'X509_Stack': ('M2Crypto.X509', 'X509_Stack'),
+    'pkcs7_read_bio_der': ('M2Crypto.m2', 'pkcs7_read_bio_der'),
+}
 
 # Lame hack to take advantage of a not well known OpenSSL flag.  This omits
 # the S/MIME capabilities when generating a PKCS#7 signature.  If included,
@@ -29,10 +81,28 @@ headers_re = re.compile(
     r"""^((?:Manifest|Signature)-Version
           |Name
           |Digest-Algorithms
-          |(?:MD5|SHA1)-Digest(?:-Manifest)?)
+          |[A-Z0-9]+-Digest(?:-Manifest)?)
           \s*:\s*(.*)""", re.X | re.I)
 continuation_re = re.compile(r"""^ (.*)""", re.I)
 directory_re = re.compile(r"[\\/]$")
+blank_lines_re = re.compile(r"\n(?:\r?\n)+")
+pem_cert_re = re.compile(r"-----BEGIN CERTIFICATE-----.*?"
+                         r"-----END CERTIFICATE-----", re.S)
+
+# Archive members are digested this many bytes at a time, which bounds the
+# memory used by JarExtractor regardless of the size of the largest member
+DIGEST_CHUNK_SIZE = 64 * 1024
+
+# Digest algorithms used for manifests and signature files unless a caller
+# asks for something else.  Names are hashlib names; the manifest headers use
+# their upper cased form, e.g. "SHA256-Digest".
+DEFAULT_ALGORITHMS = ('md5', 'sha1')
+
+# Pools JarExtractor can spread member digesting over
+POOL_BACKENDS = {
+    'thread': ThreadPool,
+    'process': multiprocessing.Pool,
+}
 
 # Python 2.6 and earlier doesn't have context manager support
 ZipFile = zipfile.ZipFile
@@ -44,10 +114,164 @@ if not hasattr(zipfile.ZipFile, "__enter__"):
             self.close()
 
 
+class _MappedFile(object):
+    """
+    A read-only memory mapping of the file at path, with the file methods
+    ZipFile needs
+
+    Member data is read from the mapping as zero copy buffer() slices, see
+    _iter_member_raw(); Python 2's mmap does not support memoryview.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            self.mapping = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.tell = self.mapping.tell
+
+    def seek(self, pos, whence=0):
+        # ZipFile looks for the end of central directory record by seeking
+        # back from the end of the file, and only expects a file's IOError
+        # when the file is too short for it
+        try:
+            self.mapping.seek(pos, whence)
+        except ValueError as e:
+            raise IOError(str(e))
+
+    def read(self, size=-1):
+        # mmap.read() has no default size in Python 2
+        if size < 0:
+            size = len(self.mapping) - self.mapping.tell()
+        return self.mapping.read(size)
+
+    def close(self):
+        self.mapping.close()
+
+
+class _MappedZipFile(ZipFile):
+
+    def __init__(self, mapped):
+        self._mapped = mapped
+        try:
+            ZipFile.__init__(self, self._mapped, 'r')
+        except:
+            self._mapped.close()
+            raise
+
+    def close(self):
+        ZipFile.close(self)
+        self._mapped.close()
+
+
+def _archive_source(source):
+    """
+    Returns what ZipFile should open for an input that may be a path, a
+    seekable file object or the bytes of the archive
+    """
+    if isinstance(source, memoryview):
+        source = source.tobytes()
+    elif isinstance(source, (bytearray, buffer)):
+        source = str(source)
+    elif not (isinstance(source, str) and '\0' in source):
+        return source
+    # Paths never contain NUL bytes and archives always do, in their end of
+    # central directory record.  cStringIO reads the string without copying.
+    return StringIO(source)
+
+
+class _CountingWriter(object):
+    """
+    Keeps track of the position in a stream that may not support tell(),
+    such as a pipe or an upload, so ZipFile can write to it
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.offset = 0
+
+    def write(self, data):
+        self.fp.write(data)
+        self.offset += len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        if hasattr(self.fp, 'flush'):
+            self.fp.flush()
+
+
+def _open_archive(path, memory_map=False):
+    # An empty file cannot be mapped, and has no members to map anyway
+    if memory_map and os.path.getsize(path):
+        return _MappedZipFile(_MappedFile(path))
+    return ZipFile(path, 'r')
+
+
 class ParsingError(Exception):
     pass
 
 
+class VerificationError(Exception):
+    pass
+
+
+class ArchiveError(Exception):
+    pass
+
+
+METAINF_EXCLUDES = ("META-INF/manifest.mf",
+                    "META-INF/*.sf",
+                    "META-INF/*.rsa",
+                    "META-INF/*.dsa",
+                    "META-INF/ids.json")
+
+
+class MemberClassifier(object):
+    """
+    Sorts archive members into directories, excluded files and kept files,
+    working out each one's file_key() at the same time
+
+    excludes is a sequence of case insensitive globs for the files dropped
+    from signed archives, METAINF_EXCLUDES by default.  Other JAR flavors
+    can add their own signature file extensions.
+    """
+
+    DIRECTORY = 'directory'
+    EXCLUDED = 'excluded'
+    KEPT = 'kept'
+
+    def __init__(self, excludes=METAINF_EXCLUDES):
+        self.excludes = tuple(excludes)
+        # Explicitly match against all upper case to prevent the kind of
+        # runtime errors that lead to https://bugzil.la/1169574.  All the
+        # globs go into one regex, so each name is only upper cased and
+        # matched once.
+        self._excluded = None
+        if self.excludes:
+            self._excluded = re.compile('|'.join(
+                '(?:%s)' % fnmatch.translate(glob.upper())
+                for glob in self.excludes))
+
+    def is_excluded(self, filename):
+        return (self._excluded is not None
+                and self._excluded.match(filename.upper()) is not None)
+
+    def kind(self, filename):
+        if self.is_excluded(filename):
+            return self.EXCLUDED
+        if directory_re.search(filename):
+            return self.DIRECTORY
+        return self.KEPT
+
+    def classify(self, infolist):
+        """
+        Returns a (file_key, kind, zinfo) tuple for every member of infolist,
+        in file_key() order
+        """
+        return sorted(((file_key(f), self.kind(f.filename), f)
+                       for f in infolist), key=lambda item: item[0])
+
+
 def ignore_certain_metainf_files(filename):
     """
     We do not support multiple signatures in XPI signing because the client
@@ -55,18 +279,7 @@ def ignore_certain_metainf_files(filename):
     on any given JAR.  This function returns True if the file name given is one
     that we dispose of to prevent multiple signatures.
     """
-    ignore = ("META-INF/manifest.mf",
-              "META-INF/*.sf",
-              "META-INF/*.rsa",
-              "META-INF/*.dsa",
-              "META-INF/ids.json")
-
-    for glob in ignore:
-        # Explicitly match against all upper case to prevent the kind of
-        # runtime errors that lead to https://bugzil.la/1169574
-        if fnmatch.fnmatchcase(filename.upper(), glob.upper()):
-            return True
-    return False
+    return _default_classifier.is_excluded(filename)
 
 
 def file_key(zinfo):
@@ -87,18 +300,491 @@ def file_key(zinfo):
     return "%d-%s-%s" % tuple(parts)
 
 
-def _digest(data):
-    md5 = hashlib.md5()
-    md5.update(data)
-    sha1 = hashlib.sha1()
-    sha1.update(data)
-    return {'md5': md5.digest(), 'sha1': sha1.digest()}
+_default_classifier = MemberClassifier()
+
+
+class ArchiveScan(object):
+    """
+    An archive's members as ArchiveScanner found them in its central
+    directory: index is what classifier.classify() returned for them,
+    members the kept ones in file_key() order and excluded the names of the
+    excluded ones
+    """
+
+    def __init__(self, index, classifier=_default_classifier):
+        self.index = index
+        self.classifier = classifier
+        self.members = [f for _, kind, f in index
+                        if kind == MemberClassifier.KEPT]
+        self.excluded = set(f.filename for _, kind, f in index
+                            if kind == MemberClassifier.EXCLUDED)
+        self.total_size = sum(f.file_size for _, _, f in index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+def _check_unique(members):
+    seen = set()
+    for f in members:
+        if f.filename in seen:
+            raise ArchiveError("Duplicate member: %r" % f.filename)
+        seen.add(f.filename)
+
+
+class ArchiveScanner(object):
+    """
+    Rejects pathological archives from their central directory alone,
+    before any member is inflated
+
+    Raises ArchiveError for archives with more than max_entries members,
+    that expand to more than max_total_size bytes, that have a member of at
+    least RATIO_MIN_SIZE bytes compressed more than max_ratio to 1, a member
+    name longer than max_name_length characters or, unless allow_duplicates,
+    two members with the same name.  A limit of None is not enforced.
+
+    JarExtractor rejects duplicate members it would sign whatever
+    allow_duplicates says.  Directories holding data are rejected too.  The
+    sizes checked are the ones the central directory declares.  Neither
+    JarExtractor nor its make_signed() ever inflates a member past its
+    declared size, so an archive that lies about them fails there instead.
+    """
+
+    # Small members are not held to max_ratio; a short run of repeated text
+    # can compress a thousandfold without being any threat
+    RATIO_MIN_SIZE = 1024 * 1024
+
+    # An empty member deflates to 2 bytes, or 5 as a stored block; some
+    # zippers deflate directory entries, so allow them a little slack
+    DIRECTORY_MAX_COMPRESSED = 16
+
+    def __init__(self, max_entries=100000, max_total_size=1024 ** 3,
+                 max_ratio=100, max_name_length=1024,
+                 allow_duplicates=False):
+        self.max_entries = max_entries
+        self.max_total_size = max_total_size
+        self.max_ratio = max_ratio
+        self.max_name_length = max_name_length
+        self.allow_duplicates = allow_duplicates
+
+    def scan(self, path, classifier=None):
+        """
+        Checks the archive at path, which may also be a seekable file object
+        or the archive's contents, and returns its ArchiveScan
+        """
+        path = _archive_source(path)
+        self.check_end_record(path)
+        with ZipFile(path, 'r') as zin:
+            return self.check(zin, classifier)
+
+    def check_end_record(self, path):
+        """
+        Checks the member count in the end of central directory record of
+        the archive at path (or in a seekable file object), so that huge
+        archives are rejected before their central directory is read
+        """
+        if self.max_entries is None:
+            return
+        if isinstance(path, basestring):
+            with open(path, 'rb') as fp:
+                endrec = zipfile._EndRecData(fp)
+        else:
+            endrec = zipfile._EndRecData(path)
+            path.seek(0)
+        if endrec is None:
+            raise zipfile.BadZipfile("File is not a zip file")
+        self._check_entries(endrec[zipfile._ECD_ENTRIES_TOTAL])
+
+    def _check_entries(self, entries):
+        if self.max_entries is not None and entries > self.max_entries:
+            raise ArchiveError("Archive has %d members, more than %d" % (
+                entries, self.max_entries))
+
+    def check(self, zin, classifier=None):
+        """
+        Checks the members of the open ZipFile zin and returns its
+        ArchiveScan, classified by classifier
+        """
+        infolist = zin.infolist()
+        # The end record's count can be wrong; the central directory is what
+        # ZipFile goes by
+        self._check_entries(len(infolist))
+        seen = set()
+        total = 0
+        for f in infolist:
+            if (self.max_name_length is not None
+                    and len(f.filename) > self.max_name_length):
+                raise ArchiveError("Member name longer than %d characters: "
+                                   "%r..." % (self.max_name_length,
+                                              f.filename[:64]))
+            if not self.allow_duplicates:
+                if f.filename in seen:
+                    raise ArchiveError("Duplicate member: %r" % f.filename)
+                seen.add(f.filename)
+            if directory_re.search(f.filename) and (
+                    f.file_size or
+                    f.compress_size > self.DIRECTORY_MAX_COMPRESSED):
+                raise ArchiveError("Directory %r has contents" % f.filename)
+            total += f.file_size
+            if (self.max_total_size is not None
+                    and total > self.max_total_size):
+                raise ArchiveError("Archive expands to more than %d bytes" %
+                                   self.max_total_size)
+            if (self.max_ratio is not None
+                    and f.file_size >= self.RATIO_MIN_SIZE
+                    and f.file_size > f.compress_size * self.max_ratio):
+                raise ArchiveError("%r is compressed more than %d to 1" % (
+                    f.filename, self.max_ratio))
+        classifier = classifier or _default_classifier
+        return ArchiveScan(classifier.classify(infolist), classifier)
+
+
+# Hash constructors by algorithm name, see _hash_constructor()
+_hash_constructors = {}
+
+
+def _hash_constructor(algo):
+    """
+    Returns a callable creating a new hash object for algo.  hashlib.new()
+    looks the algorithm up again on every call, which adds up over the tens
+    of thousands of small digests taken for a large manifest.
+    """
+    try:
+        return _hash_constructors[algo]
+    except KeyError:
+        pass
+    if algo in hashlib.algorithms:
+        constructor = getattr(hashlib, algo)
+    else:
+        # hashlib.new() raises ValueError for unknown algorithms, which is
+        # what we want callers to see
+        hashlib.new(algo)
+        constructor = functools.partial(hashlib.new, algo)
+    _hash_constructors[algo] = constructor
+    return constructor
+
+
+class Digester(object):
+    """
+    Computes several digests of the same data in a single pass
+
+    Every chunk handed to update() is fed to one hash object per algorithm,
+    so adding an algorithm costs CPU time but no extra reads of the data.
+    """
+
+    def __init__(self, algos=DEFAULT_ALGORITHMS):
+        self.algos = tuple(algos)
+        self._hashes = [(algo, _hash_constructor(algo)())
+                        for algo in self.algos]
+
+    def update(self, data):
+        for _, h in self._hashes:
+            h.update(data)
+
+    def digests(self):
+        return dict((algo, h.digest()) for algo, h in self._hashes)
+
+
+def _digest(data, algos=DEFAULT_ALGORITHMS):
+    digester = Digester(algos)
+    digester.update(data)
+    return digester.digests()
+
+
+def _digest_stream(fileobj, algos=DEFAULT_ALGORITHMS,
+                   chunk_size=DIGEST_CHUNK_SIZE, max_size=None):
+    """
+    Like _digest() but reads its data from a file-like object chunk_size
+    bytes at a time so that the whole payload never has to be in memory.
+    Raises ArchiveError if there are more than max_size bytes.
+    """
+    digester = Digester(algos)
+    size = 0
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise ArchiveError("More than %d bytes to digest" % max_size)
+        digester.update(chunk)
+    return digester.digests()
+
+
+# Archives opened by pool workers.  Each thread (or process) gets its own
+# ZipFile so that no two workers ever share a file position.
+_worker_local = threading.local()
+
+
+def _worker_archive(path, memory_map=False):
+    archives = getattr(_worker_local, 'archives', None)
+    if archives is None:
+        archives = _worker_local.archives = {}
+    if (path, memory_map) not in archives:
+        archives[path, memory_map] = _open_archive(path, memory_map)
+    return archives[path, memory_map]
+
+
+def _digest_member(zin, zinfo, algos, chunk_size, metrics=NULL_METRICS):
+    if metrics.enabled or isinstance(zin.fp, _MappedFile):
+        # Hash straight out of the mapping instead of through ZipExtFile's
+        # buffered reads.  It is also the only way of timing reading,
+        # inflating and hashing apart.
+        digester = Digester(algos)
+        chunks = _timed(_iter_member_raw(zin, zinfo, chunk_size), metrics,
+                        'digest.read')
+        for _ in _tee_inflate(chunks, zinfo, digester.update, chunk_size,
+                              metrics, 'digest.inflate', 'digest.hash'):
+            pass
+        return digester.digests()
+    with zin.open(zinfo) as member:
+        try:
+            return _digest_stream(member, algos, chunk_size,
+                                  zinfo.file_size)
+        except ArchiveError:
+            raise _oversized(zinfo)
+
+
+def _oversized(zinfo):
+    return ArchiveError("%r inflates to more than its declared %d bytes" %
+                        (zinfo.filename, zinfo.file_size))
+
+
+def _read_member(zin, zinfo, metrics=NULL_METRICS):
+    """
+    Like zin.read(zinfo), but raises ArchiveError rather than inflate a
+    member past its declared size, which ZipFile does not check
+    """
+    data = []
+    chunks = _timed(_iter_member_raw(zin, zinfo), metrics, 'make_signed.read')
+    for _ in _tee_inflate(chunks, zinfo, data.append, metrics=metrics,
+                          inflate_stage='make_signed.inflate'):
+        pass
+    # Stored members come out of a memory map as buffers
+    return ''.join(str(chunk) for chunk in data)
+
+
+def _digest_member_task(task):
+    """
+    Pool worker entry point: digests a single member of an archive
+    """
+    path, zinfo, algos, chunk_size, memory_map, metrics = task
+    return _digest_member(_worker_archive(path, memory_map), zinfo, algos,
+                          chunk_size, metrics or NULL_METRICS)
+
+
+def _member_data_offset(zin, zinfo):
+    """
+    Returns the offset in zin's file of the first byte of zinfo's compressed
+    data, which follows its variable length local file header
+    """
+    zin.fp.seek(zinfo.header_offset)
+    fheader = zin.fp.read(zipfile.sizeFileHeader)
+    if (len(fheader) != zipfile.sizeFileHeader
+            or fheader[0:4] != zipfile.stringFileHeader):
+        raise zipfile.BadZipfile("Bad magic number for file header")
+    fheader = struct.unpack(zipfile.structFileHeader, fheader)
+    return (zinfo.header_offset + zipfile.sizeFileHeader
+            + fheader[zipfile._FH_FILENAME_LENGTH]
+            + fheader[zipfile._FH_EXTRA_FIELD_LENGTH])
+
+
+def _iter_member_raw(zin, zinfo, chunk_size=DIGEST_CHUNK_SIZE):
+    """
+    Yields the compressed data of an archive member, as stored, in chunks
+    of at most chunk_size bytes
+    """
+    start = _member_data_offset(zin, zinfo)
+    if isinstance(zin.fp, _MappedFile):
+        mapping = zin.fp.mapping
+        end = start + zinfo.compress_size
+        if end > len(mapping):
+            raise zipfile.BadZipfile("Truncated data for %s" % zinfo.filename)
+        for offset in xrange(start, end, chunk_size):
+            yield buffer(mapping, offset, min(chunk_size, end - offset))
+        return
+    zin.fp.seek(start)
+    remaining = zinfo.compress_size
+    while remaining:
+        chunk = zin.fp.read(min(remaining, chunk_size))
+        if not chunk:
+            raise zipfile.BadZipfile("Truncated data for %s" % zinfo.filename)
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _timed(chunks, metrics, stage):
+    """
+    Yields chunks, timing how long each one takes to come as stage of
+    metrics.  Returns chunks as they are when metrics is disabled.
+    """
+    if not metrics.enabled:
+        return chunks
+    return _timed_chunks(iter(chunks), metrics.timer(stage))
+
+
+def _timed_chunks(chunks, timer):
+    while True:
+        with timer:
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        yield chunk
+    timer.done()
+
+
+def _tee_inflate(chunks, zinfo, callback, chunk_size=DIGEST_CHUNK_SIZE,
+                 metrics=NULL_METRICS, inflate_stage=None, callback_stage=None):
+    """
+    Passes the compressed chunks of a member through unchanged while handing
+    their inflated data to callback, at most chunk_size bytes at a time.
+    Raises ArchiveError as soon as the member inflates to more than its
+    declared size and BadZipfile once the chunks run out if the CRC does not
+    match.
+
+    Inflating, which includes the CRC, and callback are timed as
+    inflate_stage and callback_stage of metrics, if given.
+    """
+    inflating = (metrics if inflate_stage else NULL_METRICS).timer(
+        inflate_stage)
+    calling = (metrics if callback_stage else NULL_METRICS).timer(
+        callback_stage)
+    if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+        inflater = zlib.decompressobj(-15)
+    elif zinfo.compress_type == zipfile.ZIP_STORED:
+        inflater = None
+    else:
+        raise NotImplementedError("Unsupported compression method %d for "
+                                  "%s" % (zinfo.compress_type,
+                                          zinfo.filename))
+    crc = 0
+    size = 0
+    for chunk in chunks:
+        if inflater is None:
+            size += len(chunk)
+            if size > zinfo.file_size:
+                raise _oversized(zinfo)
+            with inflating:
+                crc = zlib.crc32(chunk, crc)
+            with calling:
+                callback(chunk)
+        else:
+            pending = chunk
+            while pending:
+                with inflating:
+                    data = inflater.decompress(pending, chunk_size)
+                    pending = inflater.unconsumed_tail
+                    size += len(data)
+                    if size > zinfo.file_size:
+                        raise _oversized(zinfo)
+                    crc = zlib.crc32(data, crc)
+                with calling:
+                    callback(data)
+        yield chunk
+    if inflater is not None:
+        with inflating:
+            data = inflater.flush()
+            crc = zlib.crc32(data, crc)
+        with calling:
+            callback(data)
+    if crc & 0xffffffff != zinfo.CRC:
+        raise zipfile.BadZipfile("Bad CRC-32 for file %r" % zinfo.filename)
+    inflating.done()
+    calling.done()
+
+
+def _write_member_raw(zout, zinfo, chunks, metrics=NULL_METRICS,
+                      stage=None):
+    """
+    Writes an archive member whose data is already compressed.  zinfo must
+    carry the member's final CRC and sizes, exactly as ZipFile.writestr()
+    would have computed them.  Writes are timed as stage of metrics, if
+    given.
+    """
+    writing = (metrics if stage else NULL_METRICS).timer(stage)
+    zip64 = (zinfo.file_size > zipfile.ZIP64_LIMIT
+             or zinfo.compress_size > zipfile.ZIP64_LIMIT)
+    if zip64 and not zout._allowZip64:
+        raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+    zinfo.header_offset = zout.fp.tell()
+    zout._writecheck(zinfo)
+    zout._didModify = True
+    with writing:
+        zout.fp.write(zinfo.FileHeader(zip64))
+    for chunk in chunks:
+        with writing:
+            zout.fp.write(chunk)
+    if zinfo.flag_bits & 0x08:
+        # Write CRC and file sizes after the file data
+        fmt = '<LLQQ' if zip64 else '<LLLL'
+        with writing:
+            zout.fp.write(struct.pack(fmt, zipfile._DD_SIGNATURE, zinfo.CRC,
+                                      zinfo.compress_size, zinfo.file_size))
+    zout.filelist.append(zinfo)
+    zout.NameToInfo[zinfo.filename] = zinfo
+    writing.done()
+
+
+def _copy_member_raw(zin, zout, zinfo, chunk_size=DIGEST_CHUNK_SIZE,
+                     metrics=NULL_METRICS):
+    """
+    Copies a member from zin to zout without inflating and deflating it
+    again.  The data, and therefore its digests, are unchanged.
+    """
+    chunks = _timed(_iter_member_raw(zin, zinfo, chunk_size), metrics,
+                    'make_signed.read')
+    # The copy gets its own header_offset in zout; leave zin's entry alone
+    _write_member_raw(zout, copy.copy(zinfo), chunks, metrics,
+                      'make_signed.write')
+
+
+# The _write_member_compressed() action that recompresses a member the way
+# ZipFile.writestr() would: deflated at zlib's default level if it was
+# deflated, stored if it was stored
+RECOMPRESS = None
+
+
+def _write_member_compressed(zin, zout, zinfo, action,
+                             metrics=NULL_METRICS):
+    """
+    Writes a member of zin to zout as a CompressionPolicy action says:
+    copied as it is, stored or deflated at a given zlib level.  RECOMPRESS
+    does what ZipFile.writestr() would.
+    """
+    if action == KEEP:
+        _copy_member_raw(zin, zout, zinfo, metrics=metrics)
+        return
+    data = _read_member(zin, zinfo, metrics)
+    zinfo = copy.copy(zinfo)
+    with metrics.timer('make_signed.recompress') as recompressing:
+        zinfo.CRC = zlib.crc32(data) & 0xffffffff
+        zinfo.file_size = zinfo.compress_size = len(data)
+        if action is RECOMPRESS:
+            if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                              zlib.DEFLATED, -15)
+                data = compressor.compress(data) + compressor.flush()
+                zinfo.compress_size = len(data)
+        else:
+            zinfo.compress_type = zipfile.ZIP_STORED
+            # Sizes and CRC go in the local header, so no data descriptor;
+            # bits 1 and 2 describe the deflate level used
+            zinfo.flag_bits &= ~0x0e
+            if action != STORE:
+                compressor = zlib.compressobj(action, zlib.DEFLATED, -15)
+                deflated = compressor.compress(data) + compressor.flush()
+                if len(deflated) < len(data):
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                    zinfo.compress_size = len(deflated)
+                    data = deflated
+    recompressing.done()
+    _write_member_raw(zout, zinfo, [data], metrics, 'make_signed.write')
 
 
 class Section(object):
     __slots__ = ('name', 'algos', 'digests')
 
-    def __init__(self, name, algos=('md5', 'sha1'), digests={}):
+    def __init__(self, name, algos=DEFAULT_ALGORITHMS, digests={}):
         self.name = name
         self.algos = algos
         self.digests = digests
@@ -108,34 +794,161 @@ class Section(object):
         # sensitive and should not be changed without reading through
         # http://docs.oracle.com/javase/7/docs/technotes/guides/jar/jar.html#JAR%20Manifest
         # thoroughly.
-        algos = ''
-        order = self.digests.keys()
-        order.sort()
-        for algo in order:
-            algos += " %s" % algo.upper()
-        entry = ''
-        # The spec for zip files only supports extended ASCII and UTF-8
-        # See http://www.pkware.com/documents/casestudies/APPNOTE.TXT
-        # and search for "language encoding" for details
-        #
-        # See https://bugzilla.mozilla.org/show_bug.cgi?id=1013347
-        if isinstance(self.name, unicode):
-            name = self.name.encode("utf-8")
+        algos_line, order = _digest_layout(tuple(self.digests))
+        entry = [_name_line(self.name), "\n", algos_line]
+        for algo, prefix in order:
+            entry.extend((prefix, b64encode(self.digests[algo]), "\n"))
+        return "".join(entry)
+
+
+def _name_line(name):
+    """
+    Returns the Name header of a section, wrapped onto continuation lines
+    """
+    # The spec for zip files only supports extended ASCII and UTF-8
+    # See http://www.pkware.com/documents/casestudies/APPNOTE.TXT
+    # and search for "language encoding" for details
+    #
+    # See https://bugzilla.mozilla.org/show_bug.cgi?id=1013347
+    if isinstance(name, unicode):
+        name = name.encode("utf-8")
+    name = "Name: %s" % name
+    # See https://bugzilla.mozilla.org/show_bug.cgi?id=841569#c35
+    return "\n ".join([name[i:i + 72] for i in xrange(0, len(name), 72)])
+
+
+# Memoized _digest_layout() results, keyed on the digests' algorithm names
+# in whatever order the dict yields them.  Only a handful of combinations are
+# ever in use.
+_digest_layouts = {}
+
+
+def _digest_layout(algos):
+    """
+    Returns the Digest-Algorithms line for a section with digests for algos
+    and, in the order they are written, (algo, "ALGO-Digest: ") pairs
+    """
+    try:
+        return _digest_layouts[algos]
+    except KeyError:
+        pass
+    order = sorted(algos)
+    layout = ("Digest-Algorithms:%s\n" % "".join([" %s" % algo.upper()
+                                                  for algo in order]),
+              [(algo, "%s-Digest: " % algo.upper()) for algo in order])
+    if len(_digest_layouts) < 64:
+        _digest_layouts[algos] = layout
+    return layout
+
+
+# Memoized _header_kind() results.  Manifests only ever use a handful of
+# distinct header names, so this stays tiny; the cap keeps hostile input from
+# growing it without bound.
+_header_kinds = {}
+
+
+def _header_kind(name):
+    """
+    Classifies the part of a manifest line before its colon.  Returns a
+    (kind, algo, header) triple, e.g. ('digest', 'sha1', 'sha1-digest'), or
+    None if headers_re would not accept the line.  header is the lower cased
+    header name that continuation lines are accreted under.
+    """
+    try:
+        return _header_kinds[name]
+    except KeyError:
+        pass
+    match = headers_re.match(name + ':')
+    kind = None
+    if match:
+        header = match.group(1).lower()
+        if header.endswith('-version'):
+            kind = ('version', None, header)
+        elif header.endswith('-digest-manifest'):
+            kind = ('digest-manifest', header[:-16], header)
+        elif header.endswith('-digest'):
+            kind = ('digest', header[:-7], header)
         else:
-            name = self.name
-        name = "Name: %s" % name
-        # See https://bugzilla.mozilla.org/show_bug.cgi?id=841569#c35
-        while name:
-            entry += name[:72]
-            name = name[72:]
-            if name:
-                entry += "\n "
-        entry += "\n"
-        entry += "Digest-Algorithms:%s\n" % algos
-        for algo in order:
-            entry += "%s-Digest: %s\n" % (algo.upper(),
-                                          b64encode(self.digests[algo]))
-        return entry
+            kind = (header, None, header)
+    if len(_header_kinds) < 256:
+        _header_kinds[name] = kind
+    return kind
+
+
+def _header_value(line, colon):
+    """
+    Returns the value of the header line whose name ends at colon.  The
+    spec separates the two with a single space; any other is the value's.
+    """
+    if line[colon + 1:colon + 2] == ' ':
+        return line[colon + 2:]
+    return line[colon + 1:]
+
+
+def _parse_sections(buf, kwargs):
+    """
+    Yields the Sections of the manifest text (or file-like object) buf one
+    at a time, adding any main section attributes, i.e. digest_manifests,
+    to kwargs as they are found
+    """
+    if hasattr(buf, 'readlines'):
+        fest = buf
+    else:
+        fest = StringIO(buf)
+    item = {}
+    header = ''  # persistent and used for accreting continuations
+    lineno = 0
+    # JAR spec requires two newlines at the end of a buffer to be parsed
+    # and states that they should be appended if necessary.  Just throw
+    # two newlines on every time because it won't hurt anything.
+    #
+    # Iterating over fest rather than calling readlines() keeps only one
+    # line in memory at a time, however big the manifest is.
+    for line in itertools.chain(fest, "\n" * 2):
+        lineno += 1
+        # Only the line ending: spaces, even trailing ones, can be part of
+        # a name, and one may fall either side of where it is wrapped
+        line = line.rstrip('\r\n')
+        # The limit is 72 bytes after a continuation line's leading space,
+        # which is how _name_line() wraps long names
+        if len(line) > (73 if line[:1] == ' ' else 72):
+            raise ParsingError("Manifest parsing error: line too long "
+                               "(%d)" % lineno)
+        # End of section
+        if not line:
+            if item:
+                yield Section(item.pop('name'), **item)
+                item = {}
+            header = ''
+            continue
+        # continuation?
+        if line[0] == ' ':
+            if not header:
+                raise ParsingError("Manifest parsing error: continued line"
+                                   " without previous header! Line number"
+                                   " %d" % lineno)
+            item[header] += line[1:]
+            continue
+        colon = line.find(':')
+        kind = colon > 0 and _header_kind(line[:colon])
+        if not kind:
+            raise ParsingError("Unrecognized line format: \"%s\"" % line)
+        kind, algo, header = kind
+        value = _header_value(line, colon)
+        if kind == 'digest-manifest':
+            if 'digest_manifests' not in kwargs:
+                kwargs['digest_manifests'] = {}
+            kwargs['digest_manifests'][algo] = b64decode(value)
+        elif kind == 'name':
+            if directory_re.search(value):
+                continue
+            item['name'] = value
+        elif kind == 'digest-algorithms':
+            item['algos'] = tuple(value.lower().split())
+        elif kind == 'digest':
+            if not 'digests' in item:
+                item['digests'] = {}
+            item['digests'][algo] = b64decode(value)
 
 
 class Manifest(list):
@@ -152,68 +965,8 @@ class Manifest(list):
 
     @classmethod
     def parse(klass, buf):
-        #version = None
-        if hasattr(buf, 'readlines'):
-            fest = buf
-        else:
-            fest = StringIO(buf)
         kwargs = {}
-        items = []
-        item = {}
-        header = ''  # persistent and used for accreting continuations
-        lineno = 0
-        # JAR spec requires two newlines at the end of a buffer to be parsed
-        # and states that they should be appended if necessary.  Just throw
-        # two newlines on every time because it won't hurt anything.
-        for line in itertools.chain(fest.readlines(), "\n" * 2):
-            lineno += 1
-            line = line.rstrip()
-            if len(line) > 72:
-                raise ParsingError("Manifest parsing error: line too long "
-                                   "(%d)" % lineno)
-            # End of section
-            if not line:
-                if item:
-                    items.append(Section(item.pop('name'), **item))
-                    item = {}
-                header = ''
-                continue
-            # continuation?
-            continued = continuation_re.match(line)
-            if continued:
-                if not header:
-                    raise ParsingError("Manifest parsing error: continued line"
-                                       " without previous header! Line number"
-                                       " %d" % lineno)
-                item[header] += continued.group(1)
-                continue
-            match = headers_re.match(line)
-            if not match:
-                raise ParsingError("Unrecognized line format: \"%s\"" % line)
-            header = match.group(1).lower()
-            value = match.group(2)
-            if '-version' == header[-8:]:
-                # Not doing anything with these at the moment
-                #payload = header[:-8]
-                #version = value.strip()
-                pass
-            elif '-digest-manifest' == header[-16:]:
-                if 'digest_manifests' not in kwargs:
-                    kwargs['digest_manifests'] = {}
-                kwargs['digest_manifests'][header[:-16]] = b64decode(value)
-            elif 'name' == header:
-                if directory_re.search(value):
-                    continue
-                item['name'] = value
-                continue
-            elif 'digest-algorithms' == header:
-                item['algos'] = tuple(re.split('\s*', value.lower()))
-                continue
-            elif '-digest' == header[-7:]:
-                if not 'digests' in item:
-                    item['digests'] = {}
-                item['digests'][header[:-7]] = b64decode(value)
-                continue
+        items = list(_parse_sections(buf, kwargs))
         if len(kwargs):
             return klass(items, **kwargs)
         return klass(items)
@@ -227,11 +980,32 @@ class Manifest(list):
     def body(self):
         return "\n".join([str(i) for i in self])
 
-    def __str__(self):
-        segments = [self.header, "", self.body]
+    def serialize(self, out):
+        """
+        Writes str(self) to the file-like object out, building each section
+        only once, and returns the (start, end) span of every section within
+        what was written
+        """
+        header = "%s\n\n" % self.header
+        out.write(header)
+        pos = len(header)
+        spans = []
+        for i, item in enumerate(self):
+            if i:
+                out.write("\n")
+                pos += 1
+            entry = str(item)
+            out.write(entry)
+            spans.append((pos, pos + len(entry)))
+            pos += len(entry)
         if self.extra_newline:
-            segments.append("")
-        return "\n".join(segments)
+            out.write("\n")
+        return spans
+
+    def __str__(self):
+        out = StringIO()
+        self.serialize(out)
+        return out.getvalue()
 
 
 class Signature(Manifest):
@@ -253,10 +1027,303 @@ class Signature(Manifest):
         return "\n".join(segments)
 
     # So we can omit the individual signature sections
+    def serialize(self, out):
+        if self.omit_individual_sections:
+            out.write(str(self.header) + "\n")
+            return []
+        return super(Signature, self).serialize(out)
+
+
+class CompactManifest(object):
+    """
+    A Manifest that stores its sections column by column rather than as a
+    Section, and a digests dict, per entry
+
+    Names are kept end to end in one buffer and each algorithm's digests in
+    one fixed width byte array, which takes a fraction of the memory for
+    archives with tens of thousands of members.  Sections are built when
+    they are looked at, so iterating, indexing, len(), str() and serialize()
+    work as they do on a Manifest.  Every section must have digests for the
+    same algorithms.
+    """
+    version = Manifest.version
+    extra_newline = False
+
+    def __init__(self, algos=DEFAULT_ALGORITHMS, sections=(), **kwargs):
+        self.algos = tuple(sorted(algo.lower() for algo in algos))
+        self._names = bytearray()
+        self._ends = array.array('L')
+        # Indexes of the names given as unicode, which are stored as UTF-8
+        self._unicode = set()
+        self._columns = [bytearray() for _ in self.algos]
+        self._widths = None
+        for k, v in kwargs.iteritems():
+            setattr(self, k, v)
+        self.extend(sections)
+
+    @classmethod
+    def parse(klass, buf):
+        """
+        Like Manifest.parse(), without ever holding more than one Section
+        """
+        kwargs = {}
+        sections = _parse_sections(buf, kwargs)
+        first = next(sections, None)
+        if first is None:
+            return klass(**kwargs)
+        manifest = klass(first.digests, [first])
+        manifest.extend(sections)
+        for k, v in kwargs.iteritems():
+            setattr(manifest, k, v)
+        return manifest
+
+    def append(self, name, digests):
+        """
+        Adds a section for name with digests, a dict of digests keyed by
+        algorithm
+        """
+        if sorted(digests) != list(self.algos):
+            raise ValueError("Section %r has digests for %s, not %s" % (
+                name, ", ".join(sorted(digests)), ", ".join(self.algos)))
+        widths = [len(digests[algo]) for algo in self.algos]
+        if self._widths is None:
+            self._widths = widths
+        elif widths != self._widths:
+            raise ValueError("Section %r has digests of the wrong size" %
+                             (name,))
+        if isinstance(name, unicode):
+            self._unicode.add(len(self._ends))
+            name = name.encode('utf-8')
+        self._names += name
+        self._ends.append(len(self._names))
+        for algo, column in itertools.izip(self.algos, self._columns):
+            column += digests[algo]
+
+    def extend(self, sections):
+        for section in sections:
+            self.append(section.name, section.digests)
+
+    def name(self, index):
+        end = self._ends[index]
+        index %= len(self._ends)
+        name = str(self._names[self._ends[index - 1] if index else 0:end])
+        if index in self._unicode:
+            name = name.decode('utf-8')
+        return name
+
+    def names(self):
+        return [self.name(i) for i in xrange(len(self))]
+
+    def digests(self, index):
+        index = xrange(len(self))[index]
+        return dict((algo, str(column[index * width:(index + 1) * width]))
+                    for algo, column, width in itertools.izip(
+                        self.algos, self._columns, self._widths))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        return Section(self.name(index), algos=self.algos,
+                       digests=self.digests(index))
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return len(self._ends)
+
+    @property
+    def header(self):
+        return "Manifest-Version: %s" % self.version
+
+    def serialize(self, out):
+        """
+        Like Manifest.serialize(), formatting each section straight from
+        the stored names and digests
+        """
+        header = "%s\n\n" % self.header
+        out.write(header)
+        pos = len(header)
+        spans = []
+        # self.algos is sorted, which is the order the digests are written in
+        algos_line, order = _digest_layout(self.algos)
+        columns = zip([prefix for _, prefix in order], self._columns,
+                      self._widths or ())
+        for i in xrange(len(self)):
+            if i:
+                out.write("\n")
+                pos += 1
+            entry = [_name_line(self.name(i)), "\n", algos_line]
+            for prefix, column, width in columns:
+                entry.extend((prefix,
+                              b64encode(buffer(column, i * width, width)),
+                              "\n"))
+            entry = "".join(entry)
+            out.write(entry)
+            spans.append((pos, pos + len(entry)))
+            pos += len(entry)
+        if self.extra_newline:
+            out.write("\n")
+        return spans
+
+    @property
+    def body(self):
+        return "\n".join([str(i) for i in self])
+
     def __str__(self):
+        out = StringIO()
+        self.serialize(out)
+        return out.getvalue()
+
+
+class CompactSignature(CompactManifest):
+    """
+    The CompactManifest counterpart of Signature
+    """
+    omit_individual_sections = Signature.omit_individual_sections
+    digest_manifests = {}
+    filename = Signature.filename
+
+    digest_manifest = Signature.digest_manifest
+
+    @property
+    def header(self):
+        segments = ["Signature-Version: %s" % self.version]
+        segments.extend(self.digest_manifest)
+        if self.extra_newline:
+            segments.append("")
+        return "\n".join(segments)
+
+    def serialize(self, out):
         if self.omit_individual_sections:
-            return str(self.header) + "\n"
-        return super(Signature, self).__str__()
+            out.write(str(self.header) + "\n")
+            return []
+        return super(CompactSignature, self).serialize(out)
+
+
+class LazyManifest(object):
+    """
+    A read-only view of a manifest (or signature file) that only decodes
+    the sections that are actually looked at
+
+    Building the view just indexes where each named section starts and ends
+    in the raw text; lookups by name are O(1) and decode that one section.
+    Iterating yields Sections in their original order and str() returns the
+    original text byte for byte.  Malformed sections raise ParsingError when
+    they are decoded, not when the view is built.
+    """
+
+    def __init__(self, text):
+        self._text = text
+        self._spans = []
+        self._index = {}
+        self._main = None
+        self._build_index()
+
+    @classmethod
+    def parse(klass, buf):
+        if hasattr(buf, 'read'):
+            buf = buf.read()
+        return klass(buf)
+
+    def _build_index(self):
+        text = self._text
+        start = 0
+        # Sections are separated by runs of blank lines, which a regex can
+        # find without looking at every line in between
+        for blank in blank_lines_re.finditer(text):
+            self._add_section(start, blank.start() + 1)
+            start = blank.end()
+        if text[start:].strip():
+            self._add_section(start, len(text))
+
+    def _add_section(self, start, end):
+        if not self._text[start:end].strip():
+            return
+        name = None
+        in_name = False
+        pos = start
+        # Name is nearly always the first line of a section, so this loop
+        # normally stops after it and its continuation lines
+        while pos < end:
+            eol = self._text.find('\n', pos, end)
+            if eol < 0:
+                eol = end
+            line = self._text[pos:eol].rstrip('\r\n')
+            pos = eol + 1
+            if line[:1] == ' ':
+                if in_name:
+                    name += line[1:]
+                continue
+            if in_name:
+                break
+            colon = line.find(':')
+            kind = colon > 0 and _header_kind(line[:colon])
+            if kind and kind[0] == 'name':
+                name = _header_value(line, colon)
+                in_name = True
+        self._add(name, start, end)
+
+    def _add(self, name, start, end):
+        if name is None:
+            # The main section, holding the version and *-Digest-Manifest
+            # headers
+            if self._main is None:
+                self._main = (start, end)
+        elif not directory_re.search(name):
+            self._index.setdefault(name, len(self._spans))
+            self._spans.append((name, start, end))
+
+    def _decode(self, start, end):
+        return Manifest.parse(self._text[start:end])[0]
+
+    def names(self):
+        return [name for name, _, _ in self._spans]
+
+    def section_text(self, name):
+        """
+        Returns the raw text of the named section, without the blank line
+        that ends it: exactly what a signature file's digests cover
+        """
+        _, start, end = self._spans[self._index[self._key(name)]]
+        return self._text[start:end]
+
+    @property
+    def digest_manifests(self):
+        if self._main is None:
+            return {}
+        main = Manifest.parse(self._text[self._main[0]:self._main[1]])
+        return getattr(main, 'digest_manifests', {})
+
+    def _key(self, name):
+        if isinstance(name, unicode):
+            # Names are kept as the UTF-8 bytes found in the manifest
+            name = name.encode('utf-8')
+        return name
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __getitem__(self, name):
+        _, start, end = self._spans[self._index[self._key(name)]]
+        return self._decode(start, end)
+
+    def __contains__(self, name):
+        return self._key(name) in self._index
+
+    def __iter__(self):
+        for _, start, end in self._spans:
+            yield self._decode(start, end)
+
+    def __len__(self):
+        return len(self._spans)
+
+    def __str__(self):
+        return self._text
 
 
 class JarExtractor(object):
@@ -267,71 +1334,344 @@ class JarExtractor(object):
     """
 
     def __init__(self, path, outpath=None, ids=None,
-                 omit_signature_sections=False, extra_newlines=False):
+                 omit_signature_sections=False, extra_newlines=False,
+                 chunk_size=DIGEST_CHUNK_SIZE, algorithms=DEFAULT_ALGORITHMS,
+                 workers=None, backend='thread', spool=False, cache=None,
+                 previous=None, memory_map=False, classifier=None,
+                 metrics=None, compact=False, scanner=None, scan=None):
         """
+        path is the input archive's path, a seekable file object open on it
+        or its contents as a string, bytearray or memoryview.  outpath, the
+        default output of make_signed(), may be a path or a writable stream.
+
+        chunk_size is the number of bytes of each archive member that are
+        read and hashed at a time
+
+        algorithms is the sequence of hashlib algorithm names used for the
+        manifest, the signature file sections and the *-Digest-Manifest
+        headers
+
+        workers, if greater than one, is the number of members digested at
+        the same time by a pool of threads or, with backend='process', of
+        processes.  The manifest comes out in the same order either way.
+
+        spool copies the members make_signed() needs into a temporary file,
+        still compressed, in the same pass that digests them.  make_signed()
+        then copies from that file, so the input is only read once.
+
+        cache is a signing_clients.cache.DigestCache, or anything else with
+        the same key(), get(), put() and flush() methods.  Members it already
+        has digests for are neither inflated nor hashed.
+
+        previous is the path of an earlier signed version of the archive.
+        Members with the same name, CRC-32 and size in both get their
+        digests from its META-INF/manifest.mf instead of being hashed again.
+        The previous archive is trusted as it is; it is not verified.
+
+        memory_map reads the input through a memory mapping, here and in
+        make_signed().  Member data is then hashed, inflated and, when copied
+        raw, written straight from the mapping, without the copies and small
+        reads ZipFile otherwise makes.
+
+        classifier is the MemberClassifier deciding which members are left
+        out of the manifest and the signed archive.
+
+        metrics is a signing_clients.metrics.Metrics to report stage timings
+        and member counts to, here and in make_signed().
+
+        compact keeps the manifest and signature file sections in a
+        CompactManifest and CompactSignature rather than a Manifest and
+        Signature, for archives with very many members.
+
+        scanner is an ArchiveScanner that the archive must pass before any
+        of it is inflated; ArchiveError is raised if it does not.  scan is an
+        ArchiveScan of the same input made earlier, which is used instead of
+        reading and classifying the members again.  Its classifier takes the
+        place of classifier.
+
+        ArchiveError is raised if two of the members to be signed have the
+        same name: a manifest can only hold one section per name.
         """
+        if backend not in POOL_BACKENDS:
+            raise ValueError("Unknown pool backend: %s" % backend)
+        if spool and workers > 1:
+            raise ValueError("spool and workers cannot be combined")
+        path = _archive_source(path)
+        if not isinstance(path, basestring) and (memory_map or workers > 1):
+            raise ValueError("memory_map and workers need an input path")
         self.inpath = path
+        self.memory_map = memory_map
+        self.classifier = classifier or _default_classifier
+        if scan is not None:
+            self.classifier = scan.classifier
+        self.metrics = metrics or NULL_METRICS
+        self.algos = tuple(algo.lower() for algo in algorithms)
+        # Fail early on unsupported algorithms rather than part way through
+        # the archive
+        Digester(self.algos)
         self.outpath = outpath
-        self._digests = []
+        self.compact = compact
+        self._digests = CompactManifest(self.algos) if compact else []
         self.omit_sections = omit_signature_sections
         self.extra_newlines = extra_newlines
         self._manifest = None
+        self._manifest_text = None
+        self._manifest_spans = None
         self._sig = None
+        self._sig_text = None
+        self._spool = None
         self.ids = ids
 
-        def mksection(data, fname):
-            digests = _digest(data)
-            item = Section(fname, algos=tuple(digests.keys()),
-                           digests=digests)
+        def mksection(digests, fname):
+            if compact:
+                self._digests.append(fname, digests)
+                return
+            item = Section(fname, algos=self.algos, digests=digests)
             self._digests.append(item)
-        with ZipFile(self.inpath, 'r') as zin:
-            for f in sorted(zin.filelist, key=file_key):
+        with self.metrics.stage('open'):
+            if scan is None and scanner is not None:
+                scanner.check_end_record(self.inpath)
+            zin = _open_archive(self.inpath, memory_map)
+            try:
                 # Skip directories and specific files found in META-INF/ that
-                # are not permitted in the manifest
-                if (directory_re.search(f.filename)
-                        or ignore_certain_metainf_files(f.filename)):
-                    continue
-                mksection(zin.read(f.filename), f.filename)
+                # are not permitted in the manifest.  The classification is
+                # kept for the spool and make_signed().
+                if scan is None and scanner is not None:
+                    scan = scanner.check(zin, self.classifier)
+                elif scan is None:
+                    scan = ArchiveScan(self.classifier.classify(zin.filelist),
+                                       self.classifier)
+            except:
+                zin.close()
+                raise
+        self.scan = scan
+        self._excluded = scan.excluded
+        index = scan.index
+        members = scan.members
+        with zin, self.metrics.stage('digest'):
+            _check_unique(members)
+            known = [None] * len(members)
+            if previous is not None:
+                known = self._reuse_previous(previous, members)
+            if cache is not None:
+                keys = [cache.key(zin, f, self.algos) if digest is None
+                        else None for f, digest in itertools.izip(members,
+                                                                  known)]
+                known = [cache.get(key) if digest is None else digest
+                         for key, digest in itertools.izip(keys, known)]
+            if self.metrics.enabled:
+                self._count_members(members, known)
+            if spool:
+                digests = self._digest_spooled(zin, index, chunk_size, known)
+            else:
+                todo = [f for f, digest in itertools.izip(members, known)
+                        if digest is None]
+                if workers > 1:
+                    fresh = self._digest_parallel(todo, chunk_size, workers,
+                                                  backend)
+                else:
+                    fresh = (_digest_member(zin, f, self.algos, chunk_size,
+                                            self.metrics)
+                             for f in todo)
+                fresh = iter(fresh)
+                digests = (next(fresh) if digest is None else digest
+                           for digest in known)
+            for i, (f, digest) in enumerate(itertools.izip(members, digests)):
+                if cache is not None and keys[i] is not None:
+                    cache.put(keys[i], digest)
+                mksection(digest, f.filename)
             if ids:
-                mksection(ids, 'META-INF/ids.json')
+                mksection(_digest(ids, self.algos), 'META-INF/ids.json')
+        if cache is not None:
+            cache.flush()
+
+    def _count_members(self, members, known):
+        metrics = self.metrics
+        metrics.count('members', len(members))
+        for f, digest in itertools.izip(members, known):
+            metrics.member(f)
+            if digest is None:
+                metrics.count('bytes_read', f.compress_size)
+                metrics.count('bytes_inflated', f.file_size)
+            else:
+                metrics.count('members_reused')
+
+    def _reuse_previous(self, previous, members):
+        """
+        Returns a list of the digests of members that previous already has,
+        with None for those that must be hashed
+        """
+        with ZipFile(previous, 'r') as zprev:
+            infos = dict((f.filename, f) for f in zprev.infolist())
+            try:
+                manifest = LazyManifest(zprev.read('META-INF/manifest.mf'))
+            except KeyError:
+                return [None] * len(members)
+        known = []
+        for f in members:
+            digest = None
+            old = infos.get(f.filename)
+            if (old is not None and old.CRC == f.CRC
+                    and old.file_size == f.file_size):
+                try:
+                    section = manifest.get(f.filename)
+                except (ParsingError, TypeError):
+                    # previous is only a shortcut; if its manifest does not
+                    # decode, everything is hashed as if it were not given
+                    return [None] * len(members)
+                if section is not None and all(algo in section.digests
+                                               for algo in self.algos):
+                    digest = dict((algo, section.digests[algo])
+                                  for algo in self.algos)
+            known.append(digest)
+        return known
+
+    def _digest_parallel(self, members, chunk_size, workers, backend):
+        # A Metrics cannot be shared with other processes
+        metrics = self.metrics if backend == 'thread' else None
+        tasks = [(self.inpath, f, self.algos, chunk_size, self.memory_map,
+                  metrics) for f in members]
+        pool = POOL_BACKENDS[backend](workers)
+        try:
+            # imap() returns results in the order the tasks were submitted,
+            # which keeps the sections in file_key order
+            chunksize = max(1, len(tasks) // (workers * 4))
+            return list(pool.imap(_digest_member_task, tasks, chunksize))
+        finally:
+            pool.terminate()
+            pool.join()
 
-    def _sign(self, item):
-        digests = _digest(str(item))
-        return Section(item.name, algos=tuple(digests.keys()),
-                       digests=digests)
+    def _digest_spooled(self, zin, index, chunk_size, known):
+        self._spool = tempfile.TemporaryFile(prefix='signing-clients-spool-')
+        digests = []
+        known = iter(known)
+        with ZipFile(self._spool, 'w', allowZip64=True) as spool:
+            # Same order and exclusions as the members list in __init__,
+            # except that directories are spooled but not digested
+            for _, kind, f in index:
+                if kind == MemberClassifier.EXCLUDED:
+                    continue
+                chunks = _timed(_iter_member_raw(zin, f, chunk_size),
+                                self.metrics, 'digest.read')
+                digester = digest = None
+                if kind == MemberClassifier.KEPT:
+                    digest = next(known)
+                    if digest is None:
+                        digester = Digester(self.algos)
+                        chunks = _tee_inflate(
+                            chunks, f, digester.update, chunk_size,
+                            self.metrics, 'digest.inflate', 'digest.hash')
+                _write_member_raw(spool, copy.copy(f), chunks)
+                if digester is not None:
+                    digest = digester.digests()
+                if digest is not None:
+                    digests.append(digest)
+        return digests
 
     @property
     def manifest(self):
         if not self._manifest:
-            self._manifest = Manifest(self._digests,
-                                      extra_newline=self.extra_newlines)
+            if self.compact:
+                self._digests.extra_newline = self.extra_newlines
+                self._manifest = self._digests
+            else:
+                self._manifest = Manifest(self._digests,
+                                          extra_newline=self.extra_newlines)
         return self._manifest
 
+    def _render_manifest(self):
+        # Serializes the manifest exactly once, remembering where each
+        # section landed so the signature file can digest them in place
+        if self._manifest_text is None:
+            with self.metrics.stage('serialize'):
+                out = StringIO()
+                self._manifest_spans = self.manifest.serialize(out)
+                self._manifest_text = out.getvalue()
+        return self._manifest_text
+
+    @property
+    def manifest_text(self):
+        """
+        The contents of META-INF/manifest.mf, i.e. str(self.manifest)
+        """
+        return self._render_manifest()
+
     @property
     def signatures(self):
         # The META-INF/*.sf files should contain hashes of the individual
         # sections of the the META-INF/manifest.mf file.  So we generate those
         # signatures here
         if not self._sig:
-            self._sig = Signature([self._sign(f) for f in self._digests],
-                                  digest_manifests=_digest(str(self.manifest)),
-                                  omit_individual_sections=self.omit_sections,
-                                  extra_newline=self.extra_newlines)
+            text = self._render_manifest()
+            with self.metrics.stage('serialize'):
+                if self.compact:
+                    names = self._digests.names()
+                else:
+                    names = [item.name for item in self._digests]
+                sections = (
+                    Section(name, algos=self.algos,
+                            digests=_digest(buffer(text, start, end - start),
+                                            self.algos))
+                    for name, (start, end) in itertools.izip(
+                        names, self._manifest_spans))
+                kwargs = dict(digest_manifests=_digest(text, self.algos),
+                              omit_individual_sections=self.omit_sections,
+                              extra_newline=self.extra_newlines)
+                if self.compact:
+                    self._sig = CompactSignature(self.algos, sections,
+                                                 **kwargs)
+                else:
+                    self._sig = Signature(sections, **kwargs)
         return self._sig
 
+    @property
+    def signatures_text(self):
+        """
+        The contents of the META-INF/*.sf file, i.e. str(self.signatures),
+        which is what the PKCS#7 signature must cover
+        """
+        if self._sig_text is None:
+            signatures = self.signatures
+            with self.metrics.stage('serialize'):
+                self._sig_text = str(signatures)
+        return self._sig_text
+
     @property
     def signature(self):
         # Returns only the x-Digest-Manifest signature and omits the individual
         # section signatures
         return self.signatures.header + "\n"
 
-    def make_signed(self, signature, outpath=None, sigpath=None):
+    def make_signed(self, signature, outpath=None, sigpath=None,
+                    raw_copy=False, metrics=None, compression=None):
+        """
+        Writes a signed copy of the archive to outpath, which may be a path
+        that does not exist yet or a writable stream.  Streams only need a
+        write() method and are not closed.
+
+        With raw_copy the members are copied over still compressed instead of
+        being inflated and deflated again, which is much cheaper and leaves
+        their compression exactly as it was in the input.  Members spooled
+        by the constructor are always copied this way.
+
+        compression is a signing_clients.compression.CompressionPolicy
+        choosing, member by member, between copying it raw, storing it and
+        deflating it at a given level.  It takes precedence over raw_copy.
+
+        metrics defaults to the constructor's.
+        """
+        metrics = metrics or self.metrics
         outpath = outpath or self.outpath
         if not outpath:
             raise IOError("No output file specified")
 
-        if os.path.exists(outpath):
-            raise IOError("File already exists: %s" % outpath)
+        if isinstance(outpath, basestring):
+            if os.path.exists(outpath):
+                raise IOError("File already exists: %s" % outpath)
+        else:
+            # Member offsets are then relative to where the archive starts
+            # in the stream, whatever was written to it before
+            outpath = _CountingWriter(outpath)
 
         sigpath = sigpath or signature.filename
         # Normalize to a simple filename with no extension or prefixed
@@ -339,7 +1679,22 @@ class JarExtractor(object):
         sigpath = os.path.splitext(os.path.basename(sigpath))[0]
         sigpath = os.path.join('META-INF', sigpath)
 
-        with ZipFile(self.inpath, 'r') as zin:
+        # Serialized up front so that it is not timed as part of make_signed
+        manifest_text = self.manifest_text
+        signatures_text = self.signatures_text
+        with metrics.stage('make_signed'):
+            self._write_signed(signature, outpath, sigpath, raw_copy,
+                               compression, manifest_text, signatures_text,
+                               metrics)
+
+    def _write_signed(self, signature, outpath, sigpath, raw_copy,
+                      compression, manifest_text, signatures_text, metrics):
+        if self._spool is not None:
+            raw_copy = True
+            zin = ZipFile(self._spool, 'r')
+        else:
+            zin = _open_archive(self.inpath, self.memory_map)
+        with zin:
             with ZipFile(outpath, 'w', zipfile.ZIP_DEFLATED) as zout:
                 # The PKCS7 file("foo.rsa") *MUST* be the first file in the
                 # archive to take advantage of Firefox's optimized downloading
@@ -348,50 +1703,476 @@ class JarExtractor(object):
                 for f in sorted(zin.infolist()):
                     # Make sure we exclude any of our signature and manifest
                     # files
-                    if ignore_certain_metainf_files(f.filename):
+                    if f.filename in self._excluded:
                         continue
-                    zout.writestr(f, zin.read(f.filename))
-                zout.writestr("META-INF/manifest.mf", str(self.manifest))
-                zout.writestr("%s.sf" % sigpath, str(self.signatures))
+                    if compression is not None:
+                        action = compression.action(f)
+                    elif raw_copy:
+                        action = KEEP
+                    else:
+                        action = RECOMPRESS
+                    _write_member_compressed(zin, zout, f, action, metrics)
+                zout.writestr("META-INF/manifest.mf", manifest_text)
+                zout.writestr("%s.sf" % sigpath, signatures_text)
                 if self.ids is not None:
                     zout.writestr('META-INF/ids.json', self.ids)
+                members = len(zout.filelist)
+        if metrics.enabled:
+            metrics.count('members_written', members)
+            if isinstance(outpath, _CountingWriter):
+                metrics.count('bytes_written', outpath.offset)
+            else:
+                metrics.count('bytes_written', os.path.getsize(outpath))
 
 
 class JarSigner(object):
 
-    def __init__(self, privkey, certchain):
+    def __init__(self, privkey, certchain, cert=None, metrics=None):
+        """
+        privkey is the EVP.PKey to sign with and certchain the X509_Stack
+        embedded in each signature.  cert is the signing certificate; if
+        omitted the first certificate of certchain is used.
+
+        metrics is a signing_clients.metrics.Metrics that signing is timed
+        and counted in.
+        """
         self.privkey = privkey
+        self.metrics = metrics or NULL_METRICS
         self.chain = certchain
-        self.smime = SMIME()
+        self.smime = _SMIME.SMIME()
         # We short circuit the key loading functions in the SMIME class
         self.smime.pkey = self.privkey
+        if cert is None and len(certchain):
+            # The signing certificate leads the chain.  PKCS7_sign() copes
+            # with it being in the stack too, which is left as the caller
+            # gave it.
+            cert = certchain[0]
+        if cert is not None:
+            self.smime.x509 = cert
         self.smime.set_x509_stack(self.chain)
 
-    def sign(self, data):
+    @classmethod
+    def from_pem(klass, key_pem, chain_pem, cert_pem=None, metrics=None):
+        """
+        Builds a JarSigner from PEM encoded strings: an unencrypted private
+        key, the certificate chain (any number of concatenated certificates)
+        and optionally the signing certificate
+        """
+        privkey = EVP.load_key_string(key_pem)
+        chain = X509.X509_Stack()
+        for cert in pem_cert_re.findall(chain_pem):
+            chain.push(X509.load_cert_string(cert))
+        if cert_pem is not None:
+            cert_pem = X509.load_cert_string(cert_pem)
+        return klass(privkey, chain, cert=cert_pem, metrics=metrics)
+
+    def _sign(self, data):
         # XPI signing is JAR signing which uses PKCS7 detached signatures
-        pkcs7 = self.smime.sign(MemoryBuffer(data),
-                                PKCS7_DETACHED | PKCS7_BINARY
-                                | PKCS7_NOSMIMECAP)
-        pkcs7_buffer = MemoryBuffer()
+        with self.metrics.stage('sign'):
+            pkcs7 = self.smime.sign(BIO.MemoryBuffer(data),
+                                    _SMIME.PKCS7_DETACHED
+                                    | _SMIME.PKCS7_BINARY
+                                    | PKCS7_NOSMIMECAP)
+        self.metrics.count('signatures')
+        self.metrics.count('bytes_signed', len(data))
+        return pkcs7
+
+    def sign(self, data):
+        pkcs7 = self._sign(data)
+        pkcs7_buffer = BIO.MemoryBuffer()
         pkcs7.write_der(pkcs7_buffer)
         return pkcs7
 
+    def sign_der(self, data):
+        """
+        Like sign() but returns the DER encoded signature, ready to be
+        handed to JarExtractor.make_signed()
+        """
+        pkcs7_buffer = BIO.MemoryBuffer()
+        self._sign(data).write_der(pkcs7_buffer)
+        return pkcs7_buffer.read()
+
+    def sign_many(self, items):
+        """
+        Signs every signature file in the iterable items with the already
+        loaded key and chain
+
+        Returns a list holding a (der, error) pair for each item, in order.
+        One item failing does not stop the others from being signed: its
+        der is None and error is the exception that was raised.
+        """
+        results = []
+        for data in items:
+            try:
+                results.append((self.sign_der(data), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
 
 # This is basically a dumbed down version of M2Crypto.SMIME.load_pkcs7 but
 # that reads DER instead of only PEM formatted files
+def load_pkcs7_der(pkcs7):
+    """
+    Returns a PKCS7 object for a DER formatted PKCS7 signature buffer
+    """
+    pkcs7_buf = BIO.MemoryBuffer(pkcs7)
+    if pkcs7_buf is None:
+        raise BIO.BIOError(Err.get_error())
+
+    p7_ptr = m2.pkcs7_read_bio_der(pkcs7_buf.bio)
+    return _SMIME.PKCS7(p7_ptr, 1)
+
+
+# DER encoding of the signingTime attribute's OID, 1.2.840.113549.1.9.5
+_signing_time_oid = '\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x09\x05'
+
+
+def _signing_time(pkcs7):
+    """
+    Returns the signingTime authenticated attribute of a DER formatted PKCS7
+    signature as a naive UTC datetime, or None if it has none
+    """
+    # M2Crypto has no accessor for authenticated attributes.  The OID only
+    # ever appears in them, followed by a SET holding one UTCTime or
+    # GeneralizedTime.
+    start = pkcs7.find(_signing_time_oid)
+    if start < 0:
+        return None
+    start += len(_signing_time_oid)
+    if pkcs7[start:start + 1] != '\x31':
+        return None
+    header = pkcs7[start + 2:start + 4]
+    if len(header) != 2:
+        return None
+    tag, length = header
+    value = pkcs7[start + 4:start + 4 + ord(length)]
+    try:
+        if tag == '\x17':
+            return datetime.datetime.strptime(value, '%y%m%d%H%M%SZ')
+        if tag == '\x18':
+            return datetime.datetime.strptime(value, '%Y%m%d%H%M%SZ')
+    except ValueError:
+        pass
+    return None
+
+
+class SignatureInfo(object):
+    """
+    What SignatureInspector found in a PKCS7 signature: the signing
+    certificate, as a standalone X509 object, its serial_number, issuer and
+    subject (as one line strings) and the signing_time datetime, if any
+    """
+    __slots__ = ('certificate', 'serial_number', 'issuer', 'subject',
+                 'signing_time')
+
+    def __init__(self, pkcs7):
+        p = load_pkcs7_der(pkcs7)
+        # Fetch the certificate stack that is the list of signers
+        # Since there should only be one in this use case, take the zeroth
+        # cert in the stack.  It belongs to p, so keep a copy that outlives
+        # it.
+        signer = p.get0_signers(X509.X509_Stack())[0]
+        self.certificate = X509.load_cert_der_string(signer.as_der())
+        self.serial_number = self.certificate.get_serial_number()
+        self.issuer = str(self.certificate.get_issuer())
+        self.subject = str(self.certificate.get_subject())
+        self.signing_time = _signing_time(str(pkcs7))
+
+
+class SignatureInspector(object):
+    """
+    Parses DER formatted PKCS7 signatures into SignatureInfos, keeping the
+    maxsize most recently used ones by the SHA-256 of the signature
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def inspect(self, pkcs7):
+        key = hashlib.sha256(pkcs7).digest()
+        with self._lock:
+            info = self._cache.pop(key, None)
+            if info is not None:
+                self.hits += 1
+                self._cache[key] = info
+                return info
+            self.misses += 1
+        # Parsed outside the lock; at worst two threads parse the same
+        # signature at once
+        info = SignatureInfo(pkcs7)
+        with self._lock:
+            self._cache[key] = info
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return info
+
+    def inspect_many(self, signatures):
+        """
+        Yields an (info, None) or (None, exception) pair for each signature
+        in the iterable signatures, in order
+        """
+        for pkcs7 in signatures:
+            try:
+                yield self.inspect(pkcs7), None
+            except Exception as e:
+                yield None, e
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_default_inspector = SignatureInspector()
+
+
+def inspect_signature(pkcs7):
+    """
+    Returns the SignatureInfo of a DER formatted, detached PKCS7 signature
+    buffer, parsing each distinct signature only once
+    """
+    return _default_inspector.inspect(pkcs7)
+
+
+def inspect_signatures(signatures):
+    """
+    Bulk inspect_signature(), see SignatureInspector.inspect_many()
+    """
+    return _default_inspector.inspect_many(signatures)
+
+
 def get_signature_serial_number(pkcs7):
     """
     Extracts the serial number out of a DER formatted, detached PKCS7
     signature buffer
     """
-    pkcs7_buf = MemoryBuffer(pkcs7)
-    if pkcs7_buf is None:
-        raise BIOError(Err.get_error())
+    return inspect_signature(pkcs7).serial_number
+
+
+def _ignore_purpose(ok, store_ctx):
+    # Add-on signing certificates only carry the code signing extended key
+    # usage, which OpenSSL's S/MIME purpose check rejects
+    if not ok and store_ctx.get_error() == m2.X509_V_ERR_INVALID_PURPOSE:
+        return 1
+    return ok
+
+
+def load_trust_store(pem):
+    """
+    Returns an X509_Store trusting the PEM encoded certificates in pem, for
+    use with JarVerifier
+    """
+    store = X509.X509_Store()
+    for cert in pem_cert_re.findall(pem):
+        store.add_x509(X509.load_cert_string(cert))
+    store.set_verify_cb(_ignore_purpose)
+    return store
+
+
+def _supported_algos(digests):
+    algos = []
+    for algo in sorted(digests):
+        try:
+            _hash_constructor(algo)
+        except ValueError:
+            continue
+        algos.append(algo)
+    return tuple(algos)
+
+
+def _indexed_digest_task(indexed):
+    index, task = indexed
+    return index, _digest_member_task(task)
+
+
+class JarVerifier(object):
+    """
+    Checks a signed archive, as made by JarExtractor.make_signed(), from its
+    PKCS#7 signature all the way down to the digest of every member
+    """
+
+    def __init__(self, path, store=None, chunk_size=DIGEST_CHUNK_SIZE,
+                 workers=None, backend='thread'):
+        """
+        store is the X509_Store of trusted certificates the signer must chain
+        up to, see load_trust_store().  Without it the PKCS#7 signature is
+        still checked against the certificate embedded in it, but that
+        certificate is not checked.
+
+        path, chunk_size, workers and backend are as for JarExtractor.
+        """
+        if backend not in POOL_BACKENDS:
+            raise ValueError("Unknown pool backend: %s" % backend)
+        path = _archive_source(path)
+        if not isinstance(path, basestring) and workers > 1:
+            raise ValueError("workers need an input path")
+        self.inpath = path
+        self.store = store
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.backend = backend
+
+    def verify(self):
+        """
+        Raises VerificationError on the first problem found.  Returns the
+        serial number of the signing certificate if there is none.
+        """
+        with ZipFile(self.inpath, 'r') as zin:
+            members = dict((f.filename.upper(), f) for f in zin.infolist())
+            signatures = [name for name in members
+                          if fnmatch.fnmatchcase(name, 'META-INF/*.RSA')]
+            if len(signatures) != 1:
+                raise VerificationError("Expected one META-INF/*.rsa "
+                                        "signature, found %d"
+                                        % len(signatures))
+
+            def read(name):
+                if name.upper() not in members:
+                    raise VerificationError("Missing %s" % name)
+                return zin.read(members[name.upper()])
+            pkcs7 = read(signatures[0])
+            sf = read(signatures[0][:-4] + '.SF')
+            mf = read('META-INF/manifest.mf')
+            self._verify_pkcs7(pkcs7, sf)
+            try:
+                manifest = LazyManifest(mf)
+                self._verify_signature_file(LazyManifest(sf), manifest, mf)
+                self._verify_members(zin, manifest)
+            except (ParsingError, TypeError) as e:
+                # TypeError is what b64decode() raises for bad digests
+                raise VerificationError("Malformed manifest or signature "
+                                        "file: %s" % e)
+        return get_signature_serial_number(pkcs7)
+
+    def _verify_pkcs7(self, pkcs7, sf):
+        smime = _SMIME.SMIME()
+        smime.set_x509_stack(X509.X509_Stack())
+        flags = _SMIME.PKCS7_DETACHED | _SMIME.PKCS7_BINARY
+        if self.store is None:
+            smime.set_x509_store(X509.X509_Store())
+            flags |= _SMIME.PKCS7_NOVERIFY
+        else:
+            smime.set_x509_store(self.store)
+        # M2Crypto reports the oldest error queued, which may be left over
+        # from an earlier failure
+        while Err.get_error_code():
+            pass
+        try:
+            smime.verify(load_pkcs7_der(pkcs7), BIO.MemoryBuffer(sf),
+                         flags=flags)
+        except (_SMIME.PKCS7_Error, _SMIME.SMIME_Error) as e:
+            raise VerificationError("Bad PKCS#7 signature: %s" % e)
+
+    def _check(self, name, expected, actual):
+        for algo in sorted(actual):
+            if actual[algo] != expected[algo]:
+                raise VerificationError("%s-Digest mismatch for %s"
+                                        % (algo.upper(), name))
+
+    def _verify_signature_file(self, signatures, manifest, mf):
+        expected = signatures.digest_manifests
+        algos = _supported_algos(expected)
+        if not algos:
+            raise VerificationError("No supported *-Digest-Manifest header "
+                                    "in the signature file")
+        self._check('META-INF/manifest.mf', expected, _digest(mf, algos))
+        # Per-section digests are optional, see omit_signature_sections
+        for name in signatures.names():
+            if name not in manifest:
+                raise VerificationError("%s is in the signature file but not "
+                                        "the manifest" % name)
+            expected = signatures[name].digests
+            self._check(name, expected,
+                        _digest(manifest.section_text(name),
+                                _supported_algos(expected)))
+
+    def _verify_members(self, zin, manifest):
+        tasks = []
+        listed = set()
+        for f in zin.infolist():
+            # ids.json is one of ignore_certain_metainf_files() but
+            # JarExtractor lists it in the manifests of archives it signs
+            if (directory_re.search(f.filename)
+                    or (ignore_certain_metainf_files(f.filename)
+                        and f.filename.upper() != 'META-INF/IDS.JSON')):
+                continue
+            section = manifest.get(f.filename)
+            if section is None:
+                raise VerificationError("%s is not in the manifest"
+                                        % f.filename)
+            algos = _supported_algos(section.digests)
+            if not algos:
+                raise VerificationError("No supported digest for %s"
+                                        % f.filename)
+            tasks.append((f, section.digests, algos))
+            listed.add(section.name)
+        # Check that nothing is missing before doing any of the expensive work
+        for name in manifest.names():
+            if name not in listed:
+                raise VerificationError("%s is in the manifest but not the "
+                                        "archive" % name)
+        if self.workers > 1:
+            self._verify_parallel(tasks)
+            return
+        for f, expected, algos in tasks:
+            self._check(f.filename, expected,
+                        _digest_member(zin, f, algos, self.chunk_size))
+
+    def _verify_parallel(self, tasks):
+        pool = POOL_BACKENDS[self.backend](self.workers)
+        try:
+            work = [(i, (self.inpath, f, algos, self.chunk_size, False,
+                         None))
+                    for i, (f, _, algos) in enumerate(tasks)]
+            # Unordered, so that the first mismatch to be found stops the
+            # whole run wherever it is in the archive
+            chunksize = max(1, len(work) // (self.workers * 4))
+            for i, actual in pool.imap_unordered(_indexed_digest_task, work,
+                                                 chunksize):
+                f, expected, _ = tasks[i]
+                self._check(f.filename, expected, actual)
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+class _LazyNamesModule(types.ModuleType):
+    """
+    Stands in for a module in sys.modules, with all of its attributes plus
+    names, a dict of name -> (module, attribute) that are only imported
+    when first looked up.  Setting an attribute sets it on the module too,
+    whose functions keep using its own globals.
+    """
+
+    def __init__(self, module, names):
+        types.ModuleType.__init__(self, module.__name__)
+        self.__dict__.update(module.__dict__)
+        # Python 2 clears a module's globals once nothing refers to it
+        self.__dict__['_LazyNamesModule__module'] = module
+        self.__dict__['_LazyNamesModule__names'] = names
+
+    def __getattr__(self, name):
+        try:
+            module, attr = self.__names[name]
+        except KeyError:
+            raise AttributeError("'module' object has no attribute '%s'"
+                                 % name)
+        value = getattr(importlib.import_module(module), attr)
+        self.__dict__[name] = value
+        return value
+
+    def __setattr__(self, name, value):
+        setattr(self.__module, name, value)
+        self.__dict__[name] = value
+
+    def __delattr__(self, name):
+        delattr(self.__module, name)
+        del self.__dict__[name]
 
-    p7_ptr = pkcs7_read_bio_der(pkcs7_buf.bio)
-    p = PKCS7(p7_ptr, 1)
 
-    # Fetch the certificate stack that is the list of signers
-    # Since there should only be one in this use case, take the zeroth
-    # cert in the stack and return its serial number
-    return p.get0_signers(X509_Stack())[0].get_serial_number()
+sys.modules[__name__] = _LazyNamesModule(sys.modules[__name__],
+                                         _M2CRYPTO_NAMES)
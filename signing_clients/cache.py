@@ -0,0 +1,127 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+
+import hashlib
+import sqlite3
+import threading
+
+from base64 import b64encode, b64decode
+
+from signing_clients.apps import _iter_member_raw
+
+
+class DigestCache(object):
+    """
+    A persistent store of member digests, for JarExtractor's cache argument
+
+    Members are looked up by their CRC-32, compressed and uncompressed sizes,
+    the digest algorithms asked for and a SHA-256 of their compressed bytes,
+    so a hit costs reading the member but neither inflating it nor hashing
+    it with each algorithm.  Turning verify_raw off leaves the SHA-256 out,
+    so nothing but the central directory is read; anyone can then make a
+    member with another's CRC-32 and sizes and get its digests.  Only do so
+    with a cache that never sees archives from untrusted sources.
+
+    Whoever can write to the cache decides which digests get signed, so it
+    must never be shared across a trust boundary either way.
+
+    At most max_entries digests are kept; the least recently used are
+    evicted when changes are written out by flush().
+    """
+
+    def __init__(self, path=':memory:', max_entries=100000, verify_raw=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.verify_raw = verify_raw
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS digests ("
+                         "key TEXT PRIMARY KEY, digests TEXT NOT NULL, "
+                         "tick INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS digests_tick "
+                         "ON digests (tick)")
+        self._tick = self._db.execute(
+            "SELECT COALESCE(MAX(tick), 0) FROM digests").fetchone()[0]
+        # Recency updates for hits, written out by flush()
+        self._used = {}
+
+    def key(self, zin, zinfo, algos):
+        key = '%08x:%d:%d:%s' % (zinfo.CRC & 0xffffffff, zinfo.compress_size,
+                                 zinfo.file_size, ','.join(algos))
+        if self.verify_raw:
+            raw = hashlib.sha256()
+            for chunk in _iter_member_raw(zin, zinfo):
+                raw.update(chunk)
+            key += ':' + raw.hexdigest()
+        return key
+
+    def get(self, key):
+        """
+        Returns the digests stored for key, as a dict of algorithm names to
+        binary digests, or None
+        """
+        with self._lock:
+            row = self._db.execute("SELECT digests FROM digests WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._tick += 1
+            self._used[key] = self._tick
+        return dict((algo, b64decode(digest)) for algo, digest
+                    in (pair.split(':', 1) for pair in row[0].split()))
+
+    def put(self, key, digests):
+        value = ' '.join('%s:%s' % (algo, b64encode(digest))
+                         for algo, digest in sorted(digests.iteritems()))
+        with self._lock:
+            self._tick += 1
+            self._used.pop(key, None)
+            self._db.execute("INSERT OR REPLACE INTO digests VALUES (?, ?, ?)",
+                             (key, value, self._tick))
+
+    def flush(self):
+        """
+        Commits new digests and recency updates, evicting the least recently
+        used digests beyond max_entries
+        """
+        with self._lock:
+            self._db.executemany("UPDATE digests SET tick = ? WHERE key = ?",
+                                 [(tick, key) for key, tick
+                                  in self._used.iteritems()])
+            self._used.clear()
+            excess = self._db.execute(
+                "SELECT COUNT(*) FROM digests").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._db.execute("DELETE FROM digests WHERE key IN (SELECT key "
+                                 "FROM digests ORDER BY tick LIMIT ?)",
+                                 (excess,))
+            self._db.commit()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute(
+                "SELECT COUNT(*) FROM digests").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate, 'entries': entries}
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,219 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""
+Signs, or re-signs, every XPI under a directory into a mirror of its tree
+
+    sign-xpis --key signer.key.pem --chain chain.pem in/ out/
+
+Archives are signed in parallel by a pool of worker processes, each of
+which loads the key once.  Every finished archive is recorded in a job log
+(out/.signing-log by default), so that running the same command again
+after a crash only signs what is left.  Outputs are written to a temporary
+file next to their destination and renamed into place, so an output that
+exists is always complete.
+"""
+
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from signing_clients.apps import (
+    DEFAULT_ALGORITHMS,
+    JarExtractor,
+    JarSigner,
+    Signature
+)
+
+# The JarSigner and JarExtractor arguments of a worker process, set up once
+# by _init_worker()
+_worker_signer = None
+_worker_options = None
+
+
+def _init_worker(key_pem, chain_pem, cert_pem, options):
+    global _worker_signer, _worker_options
+    _worker_signer = JarSigner.from_pem(key_pem, chain_pem, cert_pem)
+    _worker_options = options
+
+
+def sign_file(src, dest, signer, sigpath=Signature.filename, raw_copy=False,
+              **extractor_args):
+    """
+    Signs the archive at src into dest, replacing dest atomically
+    """
+    extracted = JarExtractor(src, **extractor_args)
+    signature = signer.sign_der(extracted.signatures_text)
+    dirname = os.path.dirname(dest)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # Another worker got there first
+            if not os.path.isdir(dirname):
+                raise
+    fd, tmppath = tempfile.mkstemp(dir=dirname, prefix='.signing-',
+                                   suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            extracted.make_signed(signature, out, sigpath=sigpath,
+                                  raw_copy=raw_copy)
+        # mkstemp() files are only readable by their owner
+        os.chmod(tmppath, 0o644)
+        os.rename(tmppath, dest)
+    except:
+        os.unlink(tmppath)
+        raise
+
+
+def _sign_task(task):
+    relpath, src, dest = task
+    try:
+        sign_file(src, dest, _worker_signer, **_worker_options)
+    except Exception as e:
+        return relpath, 'error', 0, '%s: %s' % (type(e).__name__, e)
+    return relpath, 'ok', os.path.getsize(src), None
+
+
+def find_archives(root, patterns):
+    """
+    Returns the paths, relative to root, of the files under root that match
+    any of patterns, in a stable order
+    """
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                found.append(os.path.relpath(os.path.join(dirpath, name),
+                                             root))
+    return found
+
+
+def read_job_log(path):
+    """
+    Returns the relative paths a job log records as signed.  A line cut
+    short by a crash is ignored.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as log:
+        for line in log:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('status') == 'ok':
+                done.add(entry['path'])
+    return done
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='sign-xpis', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help='directory of archives to sign')
+    parser.add_argument('output', help='directory to write them to')
+    parser.add_argument('--key', required=True,
+                        help='unencrypted PEM private key')
+    parser.add_argument('--chain', required=True,
+                        help='PEM certificate chain, signer first')
+    parser.add_argument('--cert', help='PEM signing certificate, if it is '
+                        'not the first certificate of --chain')
+    parser.add_argument('--pattern', action='append',
+                        help='file name glob of archives to sign, may be '
+                        'repeated (default: *.xpi)')
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--job-log',
+                        help='default: OUTPUT/.signing-log')
+    parser.add_argument('--sigpath', default=Signature.filename,
+                        help='base name of the .rsa and .sf files')
+    parser.add_argument('--algorithm', action='append', dest='algorithms',
+                        help='digest algorithm, may be repeated '
+                        '(default: %s)' % ' '.join(DEFAULT_ALGORITHMS))
+    parser.add_argument('--omit-signature-sections', action='store_true')
+    parser.add_argument('--raw-copy', action='store_true',
+                        help='copy members without recompressing them')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    job_log = args.job_log or os.path.join(args.output, '.signing-log')
+    with open(args.key) as f:
+        key_pem = f.read()
+    with open(args.chain) as f:
+        chain_pem = f.read()
+    cert_pem = None
+    if args.cert:
+        with open(args.cert) as f:
+            cert_pem = f.read()
+    # Workers that fail to load them in _init_worker() would only be
+    # restarted by the pool, forever, so check that they load first
+    try:
+        JarSigner.from_pem(key_pem, chain_pem, cert_pem)
+    except Exception as e:
+        print >> sys.stderr, ('sign-xpis: cannot load the key or '
+                              'certificates: %s' % e)
+        return 1
+    options = {
+        'sigpath': args.sigpath,
+        'raw_copy': args.raw_copy,
+        'algorithms': args.algorithms or DEFAULT_ALGORITHMS,
+        'omit_signature_sections': args.omit_signature_sections,
+    }
+
+    archives = find_archives(args.input, args.pattern or ['*.xpi'])
+    done = read_job_log(job_log)
+    tasks = [(relpath, os.path.join(args.input, relpath),
+              os.path.join(args.output, relpath))
+             for relpath in archives if relpath not in done]
+    print '%d archives, %d already signed, %d to sign' % (
+        len(archives), len(archives) - len(tasks), len(tasks))
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    signed = failed = nbytes = 0
+    start = time.time()
+    pool = multiprocessing.Pool(args.workers, _init_worker,
+                                (key_pem, chain_pem, cert_pem, options))
+    try:
+        with open(job_log, 'a') as log:
+            for relpath, status, size, error in pool.imap_unordered(
+                    _sign_task, tasks):
+                entry = {'path': relpath, 'status': status,
+                         'time': time.time()}
+                if error is not None:
+                    entry['error'] = error
+                    failed += 1
+                    print >> sys.stderr, '%s: %s' % (relpath, error)
+                else:
+                    signed += 1
+                    nbytes += size
+                log.write(json.dumps(entry) + '\n')
+                # Flushed line by line so that, whenever this process dies,
+                # every archive it saw finish stays recorded
+                log.flush()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    elapsed = max(time.time() - start, 1e-9)
+    print '%d signed, %d failed in %.1fs: %.1f files/s, %.1f MB/s' % (
+        signed, failed, elapsed, signed / elapsed,
+        nbytes / elapsed / (1024 * 1024))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
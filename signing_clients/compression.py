@@ -0,0 +1,80 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+
+import fnmatch
+import re
+
+# Copy the member exactly as it is in the input, without inflating it
+KEEP = 'keep'
+# Write the member uncompressed
+STORE = 'store'
+# Any other action is a zlib level from 1 to 9 to deflate the member at
+
+# Formats that are compressed already, so deflating them again costs CPU
+# for next to no gain
+COMPRESSED_TYPES = ('*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp',
+                    '*.woff', '*.woff2', '*.zip', '*.xpi', '*.jar', '*.gz',
+                    '*.bz2', '*.xz', '*.br', '*.mp3', '*.ogg', '*.mp4',
+                    '*.webm')
+
+
+class CompressionRule(object):
+    """
+    Applies action to the members whose base name matches one of the case
+    insensitive globs in patterns (or any member when patterns is None) and
+    whose uncompressed size is in [min_size, max_size)
+    """
+
+    def __init__(self, action, patterns=None, min_size=0, max_size=None):
+        if action not in (KEEP, STORE) and action not in range(1, 10):
+            raise ValueError("Unknown compression action: %r" % (action,))
+        self.action = action
+        self.patterns = patterns
+        self.min_size = min_size
+        self.max_size = max_size
+        self._patterns = None
+        if patterns is not None:
+            self._patterns = re.compile('|'.join(
+                '(?:%s)' % fnmatch.translate(pattern.lower())
+                for pattern in patterns))
+
+    def matches(self, zinfo):
+        if zinfo.file_size < self.min_size:
+            return False
+        if self.max_size is not None and zinfo.file_size >= self.max_size:
+            return False
+        if self._patterns is None:
+            return True
+        name = zinfo.filename.rsplit('/', 1)[-1].lower()
+        return self._patterns.match(name) is not None
+
+
+class CompressionPolicy(object):
+    """
+    Decides how JarExtractor.make_signed() writes each member: the action of
+    the first of rules that matches it, or default
+
+    Deflating never makes a member bigger; one that does not shrink is
+    stored instead.
+    """
+
+    def __init__(self, rules=(), default=KEEP):
+        self.rules = tuple(rules)
+        self.default = CompressionRule(default).action
+
+    def action(self, zinfo):
+        for rule in self.rules:
+            if rule.matches(zinfo):
+                return rule.action
+        return self.default
+
+
+# Spends as little CPU as possible: compressed formats are copied as they
+# are and everything else gets zlib's fastest level
+FAST = CompressionPolicy([CompressionRule(KEEP, COMPRESSED_TYPES)], default=1)
+
+# The smallest output, whatever it costs
+MAX_RATIO = CompressionPolicy(default=9)
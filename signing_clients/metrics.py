@@ -0,0 +1,191 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# getrusage() of the calling thread alone.  Linux has it as RUSAGE_THREAD,
+# which Python 2's resource module does not name.
+RUSAGE_THREAD = 1
+THREAD_CPU_TIME = resource is not None and sys.platform.startswith('linux')
+
+
+def _cpu_time():
+    if THREAD_CPU_TIME:
+        usage = resource.getrusage(RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+    # Elsewhere only the whole process' CPU time is to be had
+    times = os.times()
+    return times[0] + times[1]
+
+
+class _Stage(object):
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = _cpu_time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.metrics.record(self.name, time.time() - self.wall,
+                            _cpu_time() - self.cpu)
+
+
+class _Timer(object):
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.wall = self.cpu = 0.0
+
+    def __enter__(self):
+        self._wall = time.time()
+        self._cpu = _cpu_time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.wall += time.time() - self._wall
+        self.cpu += _cpu_time() - self._cpu
+
+    def done(self):
+        self.metrics.record(self.name, self.wall, self.cpu)
+
+
+class Metrics(object):
+    """
+    Collects where the time of signing goes, for the metrics argument of
+    JarExtractor, JarExtractor.make_signed() and JarSigner
+
+    stages maps each stage name to [calls, wall seconds, CPU seconds].  CPU
+    time is that of the thread doing the work on Linux, so it is not thrown
+    off by other threads sharing the Metrics, but that of the whole process
+    elsewhere.  counters maps names such as 'bytes_read' to running totals
+    and largest_member is the (size, name) of the biggest member digested.
+
+    One Metrics may be shared by many threads.  The stages are:
+
+    - open: reading the central directory and classifying members
+    - digest: reading, inflating and hashing members, split into
+      digest.read, digest.inflate and digest.hash
+    - serialize: writing out the manifest and signature file
+    - sign: the RSA signature
+    - make_signed: writing the signed archive, split into make_signed.read,
+      make_signed.inflate, make_signed.recompress and make_signed.write
+
+    The dotted stages are timed chunk by chunk and record one call per
+    member.  They are only included in their parent stage's CPU time when
+    they run on its thread, which is not the case for digest when
+    JarExtractor spreads it over workers.  Members digested by worker
+    processes are not timed at this level.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.largest_member = None
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """
+        Returns a context manager timing the code it wraps as stage name
+        """
+        return _Stage(self, name)
+
+    def timer(self, name):
+        """
+        Returns a context manager adding up the time of the code it wraps,
+        however many times it is entered, until done() records the total as
+        one call of stage name
+        """
+        return _Timer(self, name)
+
+    def record(self, name, wall, cpu):
+        with self._lock:
+            stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += 1
+            stage[1] += wall
+            stage[2] += cpu
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def member(self, zinfo):
+        with self._lock:
+            if (self.largest_member is None
+                    or zinfo.file_size > self.largest_member[0]):
+                self.largest_member = (zinfo.file_size, zinfo.filename)
+
+    def as_dict(self):
+        """
+        Returns everything collected as a flat dict of numbers, ready to
+        hand to a metrics pipeline
+        """
+        with self._lock:
+            result = dict(self.counters)
+            for name, (calls, wall, cpu) in self.stages.iteritems():
+                result['%s.calls' % name] = calls
+                result['%s.wall' % name] = wall
+                result['%s.cpu' % name] = cpu
+            if self.largest_member is not None:
+                result['largest_member'] = self.largest_member[0]
+        return result
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def done(self):
+        pass
+
+
+class _NullMetrics(object):
+    """
+    Stands in when no Metrics is given, so that instrumented code does not
+    have to check; every method does nothing
+    """
+
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def timer(self, name):
+        return self._stage
+
+    def record(self, name, wall, cpu):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def member(self, zinfo):
+        pass
+
+    def as_dict(self):
+        return {}
+
+
+NULL_METRICS = _NullMetrics()
@@ -0,0 +1,215 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+
+import sys
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from signing_clients.apps import JarExtractor, Signature
+
+
+class CancelledError(Exception):
+    pass
+
+
+class PipelineFull(Exception):
+    pass
+
+
+class SigningJob(object):
+    """
+    The pending result of SigningPipeline.submit()
+
+    Python 2 has no concurrent.futures, so this provides the parts of the
+    Future interface callers need: result(), done(), cancel() and
+    add_done_callback().  Callbacks run on a pipeline thread; an event loop
+    should hand them back to itself, e.g. with loop.call_soon_threadsafe().
+
+    timings maps each stage that ran ('queued', 'extract', 'sign' and
+    'repack') to its wall clock time in seconds.
+    """
+
+    def __init__(self, path, outpath):
+        self.path = path
+        self.outpath = outpath
+        self.timings = {}
+        self._cancelled = False
+        # Set once the last stage starts, when it is too late to cancel
+        self._finishing = False
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exc_info = None
+        # Pipeline state carried from one stage to the next
+        self._submitted = time.time()
+        self._extractor = None
+        self._signature = None
+
+    def cancel(self):
+        """
+        Stops the job before its next stage starts.  A stage that is already
+        running is allowed to finish.  Returns False if the job had already
+        completed or its last stage has started, as it will then complete
+        normally.
+        """
+        with self._lock:
+            if self._done.is_set() or self._finishing:
+                return False
+            self._cancelled = True
+            return True
+
+    def cancelled(self):
+        return (self._exc_info is not None
+                and self._exc_info[0] is CancelledError)
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Returns the path of the signed archive once the job is complete,
+        raising whatever the failing stage raised if it is not
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Signing job still running: %s" % self.path)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def add_done_callback(self, func):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _finish(self, result=None, exc_info=None):
+        with self._lock:
+            self._result = result
+            self._exc_info = exc_info
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
+
+class SigningPipeline(object):
+    """
+    Runs the extract -> sign -> repack flow for many archives at once
+    without the caller ever blocking on zip I/O, hashing or RSA
+
+    Extraction and repacking run on a pool of io_workers threads; signing
+    runs on sign_workers threads that call signer.sign_der().  When signer
+    is a SigningPool, make sign_workers match its process count so every
+    worker process is kept busy.
+
+    At most max_pending jobs are in flight; further submit() calls block,
+    or raise PipelineFull when block is false, until one completes.
+    """
+
+    def __init__(self, signer, io_workers=4, sign_workers=1, max_pending=64,
+                 sigpath=Signature.filename, **extractor_args):
+        self.signer = signer
+        self.sigpath = sigpath
+        # Reading each input once matters more than anything else here;
+        # callers can still turn it off
+        extractor_args.setdefault('spool', True)
+        self.extractor_args = extractor_args
+        self._io = ThreadPool(io_workers)
+        self._rsa = ThreadPool(sign_workers)
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, path, outpath, block=True):
+        if not self._slots.acquire(block):
+            raise PipelineFull("Too many signing jobs in flight")
+        job = SigningJob(path, outpath)
+        self._io.apply_async(self._extract, (job,))
+        return job
+
+    def sign_xpi(self, path, outpath):
+        """
+        Signs the archive at path into outpath, blocking until it is done
+        """
+        return self.submit(path, outpath).result()
+
+    def _run(self, job, stage, func, last=False):
+        """
+        Runs one stage of a job, recording its timing.  Returns False if the
+        job has finished, through failure or cancellation, and the next
+        stage must not run.  Once the last stage starts, the job can no
+        longer be cancelled.
+        """
+        with job._lock:
+            cancelled = job._cancelled
+            job._finishing = last and not cancelled
+        if cancelled:
+            self._complete(job, exc_info=(
+                CancelledError, CancelledError(job.path), None))
+            return False
+        start = time.time()
+        try:
+            func()
+        except Exception:
+            exc_info = sys.exc_info()
+            # Before completing, so waiters see the failed stage's timing
+            job.timings[stage] = time.time() - start
+            self._complete(job, exc_info=exc_info)
+            return False
+        job.timings[stage] = time.time() - start
+        return True
+
+    def _extract(self, job):
+        job.timings['queued'] = time.time() - job._submitted
+
+        def extract():
+            job._extractor = JarExtractor(job.path, **self.extractor_args)
+        if self._run(job, 'extract', extract):
+            self._rsa.apply_async(self._sign, (job,))
+
+    def _sign(self, job):
+        def sign():
+            job._signature = self.signer.sign_der(
+                job._extractor.signatures_text)
+        if self._run(job, 'sign', sign):
+            self._io.apply_async(self._repack, (job,))
+
+    def _repack(self, job):
+        def repack():
+            job._extractor.make_signed(job._signature, job.outpath,
+                                       sigpath=self.sigpath)
+        if self._run(job, 'repack', repack, last=True):
+            self._complete(job, result=job.outpath)
+
+    def _complete(self, job, result=None, exc_info=None):
+        # Drop the intermediate state, which includes the extractor's spool
+        job._extractor = job._signature = None
+        self._slots.release()
+        job._finish(result, exc_info)
+
+    def close(self):
+        """
+        Waits for submitted jobs to finish and stops the worker threads
+        """
+        # Every job gives its slot back as it completes, so holding all of
+        # them means nothing is left in flight
+        for _ in range(self.max_pending):
+            self._slots.acquire()
+        for _ in range(self.max_pending):
+            self._slots.release()
+        self._io.close()
+        self._rsa.close()
+        self._io.join()
+        self._rsa.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
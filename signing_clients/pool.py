@@ -0,0 +1,115 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+
+import collections
+import multiprocessing
+import threading
+
+from signing_clients.apps import JarSigner, load_pkcs7_der
+
+# The JarSigner of a pool worker process, built once by _init_worker()
+_worker_signer = None
+
+
+def _init_worker(key_pem, chain_pem, cert_pem):
+    global _worker_signer
+    _worker_signer = JarSigner.from_pem(key_pem, chain_pem, cert_pem)
+
+
+def _sign_in_worker(data):
+    return _worker_signer.sign_der(data)
+
+
+class SigningPool(object):
+    """
+    A JarSigner work-alike that spreads the RSA work over worker processes
+
+    M2Crypto holds the GIL for the whole of an RSA signature, so a single
+    JarSigner can never use more than one core however many threads call it.
+    Every worker process here loads the key and chain into its own SMIME
+    context once, at startup, and then signs whatever it is handed.
+
+    The key and certificates are given as PEM strings, see
+    JarSigner.from_pem(), because M2Crypto objects cannot be sent to other
+    processes.
+    """
+
+    def __init__(self, key_pem, chain_pem, cert_pem=None, processes=None):
+        # A key or chain the workers cannot load would make every worker
+        # fail in its initializer, which multiprocessing answers by starting
+        # new workers forever.  Loading it here first raises instead.
+        JarSigner.from_pem(key_pem, chain_pem, cert_pem)
+        self.processes = processes or multiprocessing.cpu_count()
+        self._pool = multiprocessing.Pool(self.processes, _init_worker,
+                                          (key_pem, chain_pem, cert_pem))
+        self._lock = threading.Lock()
+        self._inflight = collections.deque()
+
+    def submit(self, data):
+        """
+        Queues data for signing and returns a multiprocessing AsyncResult
+        whose get() returns the DER encoded signature, or raises whatever
+        signing raised
+        """
+        result = self._pool.apply_async(_sign_in_worker, (data,))
+        with self._lock:
+            self._trim()
+            self._inflight.append(result)
+        return result
+
+    def _trim(self):
+        # Results mostly complete in submission order, so trimming the
+        # finished ones off the front keeps this cheap.  Done on every
+        # submit() too, so that finished results are not kept around by
+        # callers that never look at queue_depth.
+        while self._inflight and self._inflight[0].ready():
+            self._inflight.popleft()
+
+    @property
+    def queue_depth(self):
+        """
+        Number of submitted signatures that have not completed yet
+        """
+        with self._lock:
+            self._trim()
+            return sum(1 for r in self._inflight if not r.ready())
+
+    def sign_der(self, data):
+        return self.submit(data).get()
+
+    def sign(self, data):
+        # Same return type as JarSigner.sign()
+        return load_pkcs7_der(self.sign_der(data))
+
+    def sign_many(self, items):
+        """
+        Same contract as JarSigner.sign_many(), but the items are signed
+        concurrently by the worker processes
+        """
+        results = []
+        for pending in [self.submit(data) for data in items]:
+            try:
+                results.append((pending.get(), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    def close(self):
+        """
+        Waits for queued signatures to finish and stops the workers
+        """
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,102 @@
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+
+import os
+import threading
+
+from signing_clients.apps import JarSigner
+
+
+class SignerRegistry(object):
+    """
+    Keeps a JarSigner per key ID, loaded from its PEM files
+
+    Registering a key only records where its files are.  They are read, and
+    M2Crypto imported, the first time the key is asked for or when warm() is
+    called, and read again whenever one of them has changed since.  One
+    registry may be shared by many threads.
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.loads = 0
+        self._lock = threading.Lock()
+        # key ID -> (key path, chain path, cert path or None)
+        self._paths = {}
+        # key ID -> (file stamps, JarSigner)
+        self._signers = {}
+
+    def register(self, key_id, key, chain, cert=None):
+        """
+        Makes key_id sign with the unencrypted PEM private key at path key
+        and the PEM certificate chain at path chain, signer first.  cert is
+        the path of the signing certificate, if it does not lead the chain.
+        """
+        with self._lock:
+            self._paths[key_id] = (key, chain, cert)
+            self._signers.pop(key_id, None)
+
+    def unregister(self, key_id):
+        with self._lock:
+            del self._paths[key_id]
+            self._signers.pop(key_id, None)
+
+    def get(self, key_id):
+        """
+        Returns the JarSigner for key_id, loading it first if it has not
+        been yet or if its files have changed.  Raises KeyError for key IDs
+        that were never registered.
+        """
+        with self._lock:
+            paths = self._paths[key_id]
+            stamps = self._stamps(paths)
+            loaded = self._signers.get(key_id)
+            if loaded is not None and loaded[0] == stamps:
+                return loaded[1]
+            signer = self._load(paths)
+            self._signers[key_id] = (stamps, signer)
+            return signer
+
+    __getitem__ = get
+
+    def warm(self, key_ids=None):
+        """
+        Loads the signers for key_ids, or for every registered key ID, now
+        rather than on the first signature each makes
+        """
+        if key_ids is None:
+            with self._lock:
+                key_ids = list(self._paths)
+        for key_id in key_ids:
+            self.get(key_id)
+
+    def key_ids(self):
+        with self._lock:
+            return sorted(self._paths)
+
+    def __contains__(self, key_id):
+        return key_id in self._paths
+
+    def _stamps(self, paths):
+        # The inode changes when a file is replaced by renaming a new one
+        # over it, even within the mtime's resolution
+        stamps = []
+        for path in paths:
+            if path is not None:
+                st = os.stat(path)
+                stamps.append((st.st_ino, st.st_size, st.st_mtime))
+        return stamps
+
+    def _load(self, paths):
+        pems = []
+        for path in paths:
+            if path is None:
+                pems.append(None)
+            else:
+                with open(path) as f:
+                    pems.append(f.read())
+        self.loads += 1
+        return JarSigner.from_pem(*pems, metrics=self.metrics)
@@ -5,21 +5,63 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 # ***** END LICENSE BLOCK *****
 
+import datetime
+import hashlib
 import os.path
 import sha
 import shutil
+import subprocess
+import sys
 import tempfile
+import threading
 import unittest
+import warnings
+import zipfile
+import zlib
+
+from cStringIO import StringIO
+
+from M2Crypto import EVP, X509
+from M2Crypto.BIO import MemoryBuffer
+from M2Crypto.SMIME import (SMIME, PKCS7_BINARY, PKCS7_DETACHED,
+                            PKCS7_NOVERIFY)
 
 from signing_clients.apps import (
+    ArchiveError,
+    ArchiveScanner,
+    CompactManifest,
+    CompactSignature,
     Manifest,
     JarExtractor,
+    JarSigner,
+    JarVerifier,
+    LazyManifest,
+    MemberClassifier,
     ParsingError,
+    VerificationError,
     ZipFile,
     file_key,
+    Signature,
+    SignatureInspector,
     get_signature_serial_number,
-    ignore_certain_metainf_files
+    ignore_certain_metainf_files,
+    inspect_signature,
+    inspect_signatures,
+    load_pkcs7_der,
+    load_trust_store,
+    _write_member_raw
 )
+from signing_clients import cli
+from signing_clients import compression
+from signing_clients.cache import DigestCache
+from signing_clients.metrics import Metrics
+from signing_clients.pipeline import (
+    CancelledError,
+    PipelineFull,
+    SigningPipeline
+)
+from signing_clients.pool import SigningPool
+from signing_clients.registry import SignerRegistry
 
 
 MANIFEST_BODY = """Name: test-file
@@ -105,11 +147,96 @@ MD5-Digest: +ZqzWWcMtOrWxs8Xr/tt+A==
 SHA1-Digest: B5HkCxgt6fXNr+dWPwXH2aALVWk=
 """
 
+SHA256_MANIFEST = """Manifest-Version: 1.0
+
+Name: test-file
+Digest-Algorithms: SHA1 SHA256
+SHA1-Digest: 5Hwcbg1KaPMqjDAXV/XDq/f30U0=
+SHA256-Digest: Qe6tnliOw20rXQDNEBH5c6U0V7iKUtvb/ii6XyYeg1Q=
+
+Name: test-dir/nested-test-file
+Digest-Algorithms: SHA1 SHA256
+SHA1-Digest: 4QzlrC8QyhQW1T0/Nay5kRr3gVo=
+SHA256-Digest: oGG4YXbBcs9Z2/o+/GXcM2THmJW1+eDs4v6RoJY1FxI=
+"""
+
+SHA256_SIGNATURE = """Signature-Version: 1.0
+SHA1-Digest-Manifest: 8A4GTjPL5fflugyMZYEBkVXGKEk=
+SHA256-Digest-Manifest: ivR07de2pbmjUjSW9bo64/fphLTb0z33ee3R78BoVf8=
+"""
+
 
 def test_file(fname):
     return os.path.join(os.path.dirname(__file__), fname)
 
 
+def test_signer():
+    chain = X509.X509_Stack()
+    chain.push(X509.load_cert(test_file('test-signer.cert.pem')))
+    return JarSigner(EVP.load_key(test_file('test-signer.key.pem')), chain)
+
+
+class BlockingSigner(object):
+    """
+    Signs like the test signer, but only once release is set
+    """
+
+    def __init__(self):
+        self.signer = test_signer()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def sign_der(self, data):
+        self.started.set()
+        self.release.wait()
+        return self.signer.sign_der(data)
+
+
+class BlockingStream(object):
+    """
+    A writable stream whose first write only returns once release is set
+    """
+
+    def __init__(self):
+        self.data = StringIO()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, data):
+        self.started.set()
+        self.release.wait()
+        self.data.write(data)
+
+
+class FailingSigner(object):
+
+    def sign_der(self, data):
+        raise ValueError("No key")
+
+
+def test_pem(fname):
+    with open(test_file(fname)) as f:
+        return f.read()
+
+
+def verify_detached(pkcs7, data):
+    """
+    Returns the signed data if pkcs7 is a valid detached signature of data
+    by the test signer, raises PKCS7_Error otherwise.  The test signer is a
+    code signing certificate, which OpenSSL refuses to chain for S/MIME, so
+    the chain itself is not checked.
+    """
+    smime = SMIME()
+    certs = X509.X509_Stack()
+    certs.push(X509.load_cert(test_file('test-signer.cert.pem')))
+    smime.set_x509_stack(certs)
+    store = X509.X509_Store()
+    store.load_info(test_file('test-root.cert.pem'))
+    smime.set_x509_store(store)
+    return smime.verify(pkcs7, MemoryBuffer(data),
+                        flags=PKCS7_DETACHED | PKCS7_BINARY | PKCS7_NOVERIFY)
+
+
 class SigningTest(unittest.TestCase):
 
     def setUp(self):
@@ -217,3 +344,926 @@ class SigningTest(unittest.TestCase):
         self.assertTrue(ignore_certain_metainf_files('MeTa-InF/MaNiFeSt.Mf'))
         self.assertFalse(ignore_certain_metainf_files('meta-inf/pickles.mf'))
 
+    def test_13_chunked_digests(self):
+        # Digesting members a few bytes at a time must produce exactly the
+        # same manifest as digesting them in one go
+        for chunk_size in (1, 7, 1 << 20):
+            extracted = JarExtractor(test_file('test-jar-long-path.zip'),
+                                     chunk_size=chunk_size)
+            self.assertEqual(str(extracted.manifest), VERY_LONG_MANIFEST)
+
+    def test_14_configurable_algorithms(self):
+        extracted = JarExtractor(test_file('test-jar.zip'),
+                                 omit_signature_sections=True,
+                                 algorithms=('SHA1', 'sha256'))
+        self.assertEqual(str(extracted.manifest), SHA256_MANIFEST)
+        self.assertEqual(str(extracted.signature), SHA256_SIGNATURE)
+        # And the parser understands the new headers
+        manifest = Manifest.parse(SHA256_MANIFEST)
+        self.assertEqual(manifest[0].algos, ('sha1', 'sha256'))
+        self.assertEqual(str(manifest), SHA256_MANIFEST)
+
+    def test_15_unsupported_algorithm(self):
+        self.assertRaises(ValueError, JarExtractor, test_file('test-jar.zip'),
+                          algorithms=('md5', 'not-a-hash'))
+
+    def test_16_parallel_digests(self):
+        for backend in ('thread', 'process'):
+            extracted = JarExtractor(test_file('test-jar-long-path.zip'),
+                                     workers=3, backend=backend)
+            self.assertEqual(str(extracted.manifest), VERY_LONG_MANIFEST)
+        self.assertRaises(ValueError, JarExtractor, test_file('test-jar.zip'),
+                          workers=2, backend='fibers')
+
+    def test_17_make_signed_raw_copy(self):
+        extracted = JarExtractor(test_file('test-jar-meta-inf-exclude.zip'),
+                                 omit_signature_sections=True)
+        with open(test_file('zigbert.test.pkcs7.der'), 'r') as f:
+            signature = f.read()
+        signed_file = self.tmp_file('test-jar-raw.zip')
+        extracted.make_signed(signature, signed_file, sigpath='zigbert',
+                              raw_copy=True)
+        with ZipFile(test_file('test-jar-meta-inf-exclude.zip')) as orig:
+            with ZipFile(signed_file, 'r') as zin:
+                self.assertEqual(zin.testzip(), None)
+                self.assertEqual(zin.infolist()[0].filename,
+                                 'META-INF/zigbert.rsa')
+                self.assertEqual(zin.read('META-INF/zigbert.rsa'), signature)
+                for f in orig.infolist():
+                    if ignore_certain_metainf_files(f.filename):
+                        continue
+                    copied = zin.getinfo(f.filename)
+                    self.assertEqual(copied.compress_size, f.compress_size)
+                    self.assertEqual(zin.read(f.filename), orig.read(f))
+        signed = JarExtractor(signed_file, omit_signature_sections=True)
+        self.assertEqual(str(signed.manifest), MANIFEST)
+
+    def test_18_spooled_make_signed(self):
+        extracted = JarExtractor(test_file('test-jar-meta-inf-exclude.zip'),
+                                 omit_signature_sections=True, spool=True)
+        self.assertEqual(str(extracted.manifest), MANIFEST)
+        signed_file = self.tmp_file('test-jar-spooled.zip')
+        extracted.make_signed('not really a signature', signed_file,
+                              sigpath='zigbert')
+        with ZipFile(signed_file, 'r') as zin:
+            self.assertEqual(zin.testzip(), None)
+            names = [f.filename for f in zin.infolist()]
+            self.assertEqual(names[0], 'META-INF/zigbert.rsa')
+            self.assertEqual(sorted(names[1:]),
+                             ['META-INF/manifest.mf', 'META-INF/zigbert.sf',
+                              'test-dir/nested-test-file', 'test-file'])
+        signed = JarExtractor(signed_file, omit_signature_sections=True)
+        self.assertEqual(str(signed.manifest), MANIFEST)
+
+    def test_19_spool_detects_corruption(self):
+        corrupt = self.tmp_file('corrupt.zip')
+        with ZipFile(corrupt, 'w', zipfile.ZIP_STORED) as zout:
+            zout.writestr('test-file', 'x' * 100)
+        with open(corrupt, 'rb') as f:
+            data = f.read()
+        # The stored data no longer matches the CRC in the headers
+        with open(corrupt, 'wb') as f:
+            f.write(data.replace('x' * 100, 'x' * 99 + 'y'))
+        self.assertRaises(zipfile.BadZipfile, JarExtractor, corrupt,
+                          spool=True)
+
+    def test_20_sign(self):
+        signer = test_signer()
+        extracted = self._extract(omit=True)
+        pkcs7 = signer.sign(str(extracted.signatures))
+        self.assertEqual(verify_detached(pkcs7, str(extracted.signatures)),
+                         str(extracted.signatures))
+        self.assertRaises(Exception, verify_detached, pkcs7, SIGNATURES)
+        der = signer.sign_der(str(extracted.signatures))
+        self.assertEqual(get_signature_serial_number(der), 500)
+
+    def test_21_sign_many(self):
+        signer = test_signer()
+        results = signer.sign_many([SIGNATURE, object(), SIGNATURES])
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[1][0], None)
+        self.assertTrue(isinstance(results[1][1], Exception))
+        for (der, error), data in zip(results[::2], [SIGNATURE, SIGNATURES]):
+            self.assertEqual(error, None)
+            self.assertEqual(get_signature_serial_number(der), 500)
+
+    def test_22_signer_from_pem(self):
+        signer = JarSigner.from_pem(test_pem('test-signer.key.pem'),
+                                    test_pem('test-signer.cert.pem')
+                                    + test_pem('test-root.cert.pem'))
+        self.assertEqual(signer.smime.x509.get_serial_number(), 500)
+        pkcs7 = signer.sign(SIGNATURE)
+        self.assertEqual(verify_detached(pkcs7, SIGNATURE), SIGNATURE)
+
+    def test_23_signing_pool(self):
+        with SigningPool(test_pem('test-signer.key.pem'),
+                         test_pem('test-signer.cert.pem'),
+                         processes=2) as pool:
+            pkcs7 = pool.sign(SIGNATURE)
+            self.assertEqual(verify_detached(pkcs7, SIGNATURE), SIGNATURE)
+            futures = [pool.submit(SIGNATURES) for _ in range(8)]
+            for future in futures:
+                self.assertEqual(get_signature_serial_number(future.get()),
+                                 500)
+            self.assertEqual(pool.queue_depth, 0)
+            results = pool.sign_many([SIGNATURE, object()])
+            self.assertEqual(get_signature_serial_number(results[0][0]), 500)
+            self.assertEqual(results[1][0], None)
+            self.assertTrue(isinstance(results[1][1], Exception))
+            for _ in range(20):
+                pool.sign_der(SIGNATURE)
+            self.assertTrue(len(pool._inflight) <= 1)
+        self.assertRaises(EVP.EVPError, SigningPool, 'garbage',
+                          test_pem('test-signer.cert.pem'), processes=1)
+
+    def test_24_pipeline(self):
+        signed_file = self.tmp_file('test-jar-pipeline.zip')
+        with SigningPipeline(test_signer(), omit_signature_sections=True,
+                             algorithms=('sha1', 'sha256')) as pipeline:
+            job = pipeline.submit(test_file('test-jar.zip'), signed_file)
+            self.assertEqual(job.result(), signed_file)
+        self.assertEqual(sorted(job.timings),
+                         ['extract', 'queued', 'repack', 'sign'])
+        with ZipFile(signed_file, 'r') as zin:
+            self.assertEqual(zin.read('META-INF/manifest.mf'),
+                             SHA256_MANIFEST)
+            sf = zin.read('META-INF/zigbert.sf')
+            self.assertEqual(sf, SHA256_SIGNATURE)
+            pkcs7 = load_pkcs7_der(zin.read('META-INF/zigbert.rsa'))
+            self.assertEqual(verify_detached(pkcs7, sf), sf)
+
+    def test_25_pipeline_backpressure_and_cancel(self):
+        signer = BlockingSigner()
+        pipeline = SigningPipeline(signer, max_pending=2)
+        self.addCleanup(pipeline.close)
+        self.addCleanup(signer.release.set)
+        first = pipeline.submit(test_file('test-jar.zip'),
+                                self.tmp_file('first.zip'))
+        second = pipeline.submit(test_file('test-jar.zip'),
+                                 self.tmp_file('second.zip'))
+        self.assertRaises(PipelineFull, pipeline.submit,
+                          test_file('test-jar.zip'),
+                          self.tmp_file('third.zip'), block=False)
+        # The only signing thread is stuck on the first job, so the second
+        # can not have reached its signing stage yet
+        signer.started.wait()
+        self.assertTrue(second.cancel())
+        done = []
+        second.add_done_callback(done.append)
+        signer.release.set()
+        self.assertEqual(first.result(), self.tmp_file('first.zip'))
+        self.assertRaises(CancelledError, second.result)
+        self.assertTrue(second.cancelled())
+        self.assertEqual(done, [second])
+        self.assertFalse(os.path.exists(self.tmp_file('second.zip')))
+        self.assertFalse(first.cancel())
+
+    def test_26_parse_errors(self):
+        for manifest, message in [
+                (MANIFEST + "Namespace: foo\n",
+                 'Unrecognized line format: "Namespace: foo"'),
+                (MANIFEST + "\n continued\n",
+                 "Manifest parsing error: continued line without previous "
+                 "header! Line number 13"),
+                (BROKEN_MANIFEST,
+                 "Manifest parsing error: line too long (13)")]:
+            try:
+                Manifest.parse(manifest)
+            except ParsingError as e:
+                self.assertEqual(str(e), message)
+            else:
+                self.fail("ParsingError not raised for %r" % manifest)
+
+    def test_27_parse_file(self):
+        fname = self.tmp_file('manifest.mf')
+        with open(fname, 'w') as f:
+            f.write(CONTINUED_MANIFEST)
+        with open(fname) as f:
+            manifest = Manifest.parse(f)
+        self.assertEqual(str(manifest), CONTINUED_MANIFEST)
+        self.assertEqual(manifest[-1].name, 'test-dir/nested-test-dir/'
+                         'nested-test-dir/nested-test-dir/nested-test-file')
+
+    def test_28_lazy_manifest(self):
+        for text in (MANIFEST, CONTINUED_MANIFEST, VERY_LONG_MANIFEST,
+                     UNICODE_MANIFEST, SIGNATURES, EXTRA_NEWLINE_SIGNATURES):
+            lazy = LazyManifest(text)
+            self.assertEqual(str(lazy), text)
+            parsed = Manifest.parse(text)
+            self.assertEqual(len(lazy), len(parsed))
+            self.assertEqual([str(i) for i in lazy],
+                             [str(i) for i in parsed])
+            self.assertEqual(lazy.names(), [i.name for i in parsed])
+
+        lazy = LazyManifest(CONTINUED_MANIFEST)
+        name = ('test-dir/nested-test-dir/nested-test-dir/nested-test-dir/'
+                'nested-test-file')
+        self.assertTrue(name in lazy)
+        self.assertFalse('no-such-file' in lazy)
+        self.assertEqual(lazy[name].digests, lazy['test-dir/nested-test-file']
+                         .digests)
+        self.assertRaises(KeyError, lambda: lazy['no-such-file'])
+        self.assertEqual(lazy.get('no-such-file'), None)
+        self.assertEqual(LazyManifest(UNICODE_MANIFEST)[
+            u'test-dir/s\xfait\xe9-h\xf6\xf1e.txt'].name,
+            'test-dir/s\xc3\xbait\xc3\xa9-h\xc3\xb6\xc3\xb1e.txt')
+
+    def test_29_lazy_signature_sections(self):
+        signatures = LazyManifest(SIGNATURES)
+        self.assertEqual(sorted(signatures.digest_manifests),
+                         ['md5', 'sha1'])
+        # The .sf digests cover each manifest section's raw text
+        manifest = LazyManifest(MANIFEST)
+        for name in manifest.names():
+            self.assertEqual(
+                signatures[name].digests['sha1'],
+                sha.new(manifest.section_text(name)).digest())
+
+    def test_30_serialize_spans(self):
+        for newlines in (False, True):
+            extracted = JarExtractor(test_file('test-jar-long-path.zip'),
+                                     omit_signature_sections=False,
+                                     extra_newlines=newlines)
+            out = StringIO()
+            spans = extracted.manifest.serialize(out)
+            text = out.getvalue()
+            self.assertEqual(text, str(extracted.manifest))
+            self.assertEqual(extracted.manifest_text, text)
+            self.assertEqual([text[start:end] for start, end in spans],
+                             [str(i) for i in extracted.manifest])
+            self.assertEqual(extracted.signatures_text,
+                             str(extracted.signatures))
+            # Section digests in the signature file cover each manifest
+            # section's text
+            lazy = LazyManifest(text)
+            for item in extracted.signatures:
+                self.assertEqual(item.digests['sha1'], sha.new(
+                    lazy.section_text(item.name)).digest())
+
+    def _signed(self, fname, **kwargs):
+        signed_file = self.tmp_file(fname)
+        extracted = JarExtractor(test_file('test-jar.zip'), ids='{}',
+                                 **kwargs)
+        extracted.make_signed(test_signer().sign_der(extracted.signatures_text),
+                              signed_file, sigpath='zigbert')
+        return signed_file
+
+    def _rewrite(self, path, fname, replacements):
+        # Copies the archive at path, swapping the content of some members
+        rewritten = self.tmp_file(fname)
+        with ZipFile(path, 'r') as zin:
+            with ZipFile(rewritten, 'w') as zout:
+                for f in zin.infolist():
+                    zout.writestr(f, replacements.get(f.filename,
+                                                      zin.read(f.filename)))
+        return rewritten
+
+    def test_31_verify(self):
+        store = load_trust_store(test_pem('test-root.cert.pem'))
+        signed_file = self._signed('signed.zip')
+        self.assertEqual(JarVerifier(signed_file, store).verify(), 500)
+        self.assertEqual(JarVerifier(signed_file).verify(), 500)
+        self.assertEqual(JarVerifier(signed_file, store, workers=2).verify(),
+                         500)
+        sections_omitted = self._signed('omitted.zip',
+                                        omit_signature_sections=True)
+        self.assertEqual(JarVerifier(sections_omitted, store).verify(), 500)
+        # Not signed by anything the store trusts
+        self.assertRaises(VerificationError,
+                          JarVerifier(signed_file, load_trust_store('')).verify)
+        self.assertRaises(VerificationError,
+                          JarVerifier(test_file('test-jar.zip')).verify)
+
+    def test_32_verify_tampered(self):
+        signed_file = self._signed('signed.zip')
+        with ZipFile(signed_file, 'r') as zin:
+            manifest = zin.read('META-INF/manifest.mf')
+            sf = zin.read('META-INF/zigbert.sf')
+        tampered = [
+            {'test-file': 'tampered\n'},
+            {'META-INF/ids.json': '{"id": "tampered"}'},
+            {'META-INF/manifest.mf': manifest.replace('test-file',
+                                                      'test-fil0')},
+            {'META-INF/zigbert.sf': sf + '\n'},
+            {'META-INF/zigbert.rsa': test_signer().sign_der(SIGNATURES)},
+        ]
+        for i, replacements in enumerate(tampered):
+            path = self._rewrite(signed_file, 'tampered-%d.zip' % i,
+                                 replacements)
+            for workers in (None, 2):
+                self.assertRaises(VerificationError,
+                                  JarVerifier(path, workers=workers).verify)
+
+    def test_33_digest_cache(self):
+        path = self.tmp_file('digests.sqlite')
+        expected = str(self._extract().manifest)
+        for kwargs in ({}, {'spool': True}, {'workers': 2}):
+            with DigestCache(path) as cache:
+                extracted = JarExtractor(test_file('test-jar.zip'),
+                                         cache=cache, **kwargs)
+                self.assertEqual(str(extracted.manifest), expected)
+            with DigestCache(path) as cache:
+                extracted = JarExtractor(test_file('test-jar.zip'),
+                                         cache=cache, **kwargs)
+                self.assertEqual(str(extracted.manifest), expected)
+                self.assertEqual((cache.hits, cache.misses), (2, 0))
+                self.assertEqual(cache.hit_rate, 1.0)
+        # A different set of algorithms misses
+        with DigestCache(path) as cache:
+            JarExtractor(test_file('test-jar.zip'), cache=cache,
+                         algorithms=('sha1', 'sha256'))
+            self.assertEqual(cache.stats(), {'hits': 0, 'misses': 2,
+                                             'hit_rate': 0.0, 'entries': 4})
+        # The least recently used entries go first
+        with DigestCache(path, max_entries=2) as cache:
+            JarExtractor(test_file('test-jar.zip'), cache=cache)
+            self.assertEqual(cache.hits, 2)
+        with DigestCache(path) as cache:
+            self.assertEqual(cache.stats()['entries'], 2)
+            JarExtractor(test_file('test-jar.zip'), cache=cache)
+            self.assertEqual(cache.hits, 2)
+        # A member with another's CRC-32 and sizes but other bytes only
+        # shares its key when the bytes are left out of it
+        with ZipFile(test_file('test-jar.zip'), 'r') as zin:
+            altered = zin.read('test-file').swapcase()
+        collision = self._rewrite(test_file('test-jar.zip'), 'collision.zip',
+                                  {'test-file': altered})
+        with ZipFile(test_file('test-jar.zip'), 'r') as zin:
+            with ZipFile(collision, 'r') as zcollision:
+                f = zin.getinfo('test-file')
+                forged = zcollision.getinfo('test-file')
+                self.assertEqual(forged.file_size, f.file_size)
+                forged.CRC = f.CRC
+                forged.compress_size = f.compress_size
+                with DigestCache() as cache:
+                    cache.put(cache.key(zin, f, ('sha1',)), {'sha1': 'x'})
+                    self.assertEqual(
+                        cache.get(cache.key(zcollision, forged, ('sha1',))),
+                        None)
+                with DigestCache(verify_raw=False) as cache:
+                    self.assertEqual(cache.key(zin, f, ('sha1',)),
+                                     cache.key(zcollision, forged, ('sha1',)))
+
+    def test_34_previous_version(self):
+        previous = self._signed('previous.zip')
+        updated = self._rewrite(test_file('test-jar.zip'), 'updated.zip',
+                                {'test-file': 'updated\n'})
+        fresh = JarExtractor(updated)
+        for kwargs in ({}, {'spool': True}, {'workers': 2},
+                       {'cache': DigestCache()}):
+            extracted = JarExtractor(updated, previous=previous, **kwargs)
+            self.assertEqual(str(extracted.manifest), str(fresh.manifest))
+        with ZipFile(updated, 'r') as zin:
+            members = [zin.getinfo('test-file'),
+                       zin.getinfo('test-dir/nested-test-file')]
+        known = fresh._reuse_previous(previous, members)
+        self.assertEqual(known[0], None)
+        self.assertEqual(sorted(known[1]), ['md5', 'sha1'])
+        # Digests the previous manifest does not have must be computed
+        known = JarExtractor(updated, algorithms=('sha256',))._reuse_previous(
+            previous, members)
+        self.assertEqual(known, [None, None])
+        self.assertEqual(fresh._reuse_previous(test_file('test-jar.zip'),
+                                               members), [None, None])
+        # A manifest that does not decode is ignored
+        broken = self._rewrite(previous, 'broken.zip', {
+            'META-INF/manifest.mf': MANIFEST.replace(
+                'Name: test-dir/nested-test-file\n',
+                'Name: test-dir/nested-test-file\nBogus\n')})
+        self.assertEqual(fresh._reuse_previous(broken, members), [None, None])
+        extracted = JarExtractor(updated, previous=broken)
+        self.assertEqual(str(extracted.manifest), str(fresh.manifest))
+
+    def test_35_memory_map(self):
+        mixed = self.tmp_file('mixed.zip')
+        with ZipFile(mixed, 'w') as zout:
+            zout.writestr(zipfile.ZipInfo('stored'), 'stored\n' * 10000)
+            info = zipfile.ZipInfo('deflated')
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zout.writestr(info, 'deflated\n' * 10000)
+        for path in (test_file('test-jar.zip'), mixed):
+            expected = JarExtractor(path)
+            for kwargs in ({}, {'spool': True}, {'workers': 2},
+                           {'chunk_size': 1000},
+                           {'cache': DigestCache(verify_raw=True)}):
+                extracted = JarExtractor(path, memory_map=True, **kwargs)
+                self.assertEqual(str(extracted.manifest),
+                                 str(expected.manifest))
+            for raw_copy in (False, True):
+                signed_file = self.tmp_file('signed-%s.zip' % raw_copy)
+                extracted.make_signed(SIGNATURE, signed_file,
+                                      sigpath='zigbert', raw_copy=raw_copy)
+                with ZipFile(path, 'r') as zin:
+                    with ZipFile(signed_file, 'r') as zsigned:
+                        for f in zin.infolist():
+                            self.assertEqual(zsigned.read(f.filename),
+                                             zin.read(f.filename))
+                os.unlink(signed_file)
+
+    def test_36_in_memory_io(self):
+        class Upload(object):
+            # Write only, like a pipe or an object storage upload
+            def __init__(self):
+                self.chunks = []
+
+            def write(self, data):
+                self.chunks.append(str(data))
+
+        with open(test_file('test-jar.zip'), 'rb') as fp:
+            data = fp.read()
+        expected = str(JarExtractor(test_file('test-jar.zip'),
+                                    ids='{}').manifest)
+        signer = test_signer()
+        with open(test_file('test-jar.zip'), 'rb') as fp:
+            for source in (data, bytearray(data), memoryview(data),
+                           StringIO(data), fp):
+                for kwargs in ({}, {'spool': True}):
+                    extracted = JarExtractor(source, ids='{}', **kwargs)
+                    self.assertEqual(str(extracted.manifest), expected)
+                    signature = signer.sign_der(extracted.signatures_text)
+                    for raw_copy in (False, True):
+                        upload = Upload()
+                        extracted.make_signed(signature, upload,
+                                              sigpath='zigbert',
+                                              raw_copy=raw_copy)
+                        signed = ''.join(upload.chunks)
+                        self.assertEqual(JarVerifier(signed).verify(), 500)
+        out = StringIO()
+        out.write('not part of the archive')
+        extracted.make_signed(signature, out, sigpath='zigbert')
+        self.assertEqual(JarVerifier(StringIO(out.getvalue()[23:])).verify(),
+                         500)
+        self.assertRaises(ValueError, JarExtractor, data, workers=2)
+        self.assertRaises(ValueError, JarExtractor, data, memory_map=True)
+        # Files too short to be archives fail just as they do unmapped
+        for data in ('', 'short'):
+            path = self.tmp_file('short-%d.zip' % len(data))
+            with open(path, 'wb') as f:
+                f.write(data)
+            for memory_map in (False, True):
+                self.assertRaises(zipfile.BadZipfile, JarExtractor, path,
+                                  memory_map=memory_map)
+
+    def test_37_member_classifier(self):
+        names = ['install.rdf', 'content/', 'content/a.js', 'LICENSE',
+                 'META-INF/', 'META-INF/zigbert.RSA', 'meta-inf/ZIGBERT.sf',
+                 'META-INF/manifest.MF', 'META-INF/ids.json',
+                 'META-INF/sub/x.rsa', 'x/META-INF/a.sf', 'META-INF/a.sfx',
+                 'META-INF/a.ec']
+        infolist = [zipfile.ZipInfo(name) for name in names]
+        classifier = MemberClassifier()
+        index = classifier.classify(infolist)
+        self.assertEqual([key for key, _, _ in index],
+                         sorted(file_key(f) for f in infolist))
+        kinds = dict((f.filename, kind) for _, kind, f in index)
+        for name in names:
+            if name.endswith('/'):
+                self.assertEqual(kinds[name], MemberClassifier.DIRECTORY)
+            elif ignore_certain_metainf_files(name):
+                self.assertEqual(kinds[name], MemberClassifier.EXCLUDED)
+            else:
+                self.assertEqual(kinds[name], MemberClassifier.KEPT)
+        self.assertEqual(kinds['META-INF/sub/x.rsa'],
+                         MemberClassifier.EXCLUDED)
+        self.assertEqual(kinds['x/META-INF/a.sf'], MemberClassifier.KEPT)
+        self.assertEqual(kinds['META-INF/a.ec'], MemberClassifier.KEPT)
+        signed = MemberClassifier(('META-INF/*.sf', 'META-INF/*.ec'))
+        self.assertTrue(signed.is_excluded('meta-inf/A.EC'))
+        self.assertFalse(signed.is_excluded('META-INF/zigbert.rsa'))
+        self.assertFalse(MemberClassifier(()).is_excluded('META-INF/a.sf'))
+
+        extracted = JarExtractor(test_file('test-jar.zip'),
+                                 classifier=MemberClassifier(['test-f*']))
+        self.assertEqual([item.name for item in extracted.manifest],
+                         ['test-dir/nested-test-file'])
+        signed_file = self.tmp_file('classified.zip')
+        extracted.make_signed(SIGNATURE, signed_file, sigpath='zigbert')
+        with ZipFile(signed_file, 'r') as zin:
+            self.assertFalse('test-file' in zin.namelist())
+
+    def test_38_metrics(self):
+        metrics = Metrics()
+        extracted = JarExtractor(test_file('test-jar.zip'), metrics=metrics)
+        extracted.make_signed(test_signer().sign_der(
+            extracted.signatures_text), self.tmp_file('signed.zip'),
+            sigpath='zigbert')
+        self.assertEqual(sorted(metrics.stages),
+                         ['digest', 'digest.hash', 'digest.inflate',
+                          'digest.read', 'make_signed', 'make_signed.inflate',
+                          'make_signed.read', 'make_signed.recompress',
+                          'make_signed.write', 'open', 'serialize'])
+        self.assertEqual(metrics.stages['make_signed'][0], 1)
+        # Sub-stages are recorded once per member
+        self.assertEqual(metrics.stages['digest.read'][0], 2)
+        self.assertEqual(metrics.stages['digest.hash'][0], 2)
+        # test-dir/, its file and test-file
+        self.assertEqual(metrics.stages['make_signed.recompress'][0], 3)
+        with ZipFile(test_file('test-jar.zip'), 'r') as zin:
+            members = [zin.getinfo('test-file'),
+                       zin.getinfo('test-dir/nested-test-file')]
+        self.assertEqual(metrics.counters['members'], 2)
+        self.assertEqual(metrics.counters['bytes_read'],
+                         sum(f.compress_size for f in members))
+        self.assertEqual(metrics.counters['bytes_inflated'],
+                         sum(f.file_size for f in members))
+        self.assertEqual(metrics.counters['bytes_written'],
+                         os.path.getsize(self.tmp_file('signed.zip')))
+        # test-dir/, its file, test-file, .rsa, .sf and manifest.mf
+        self.assertEqual(metrics.counters['members_written'], 6)
+        self.assertEqual(metrics.largest_member[0],
+                         max(f.file_size for f in members))
+
+        signer = test_signer()
+        signer.metrics = metrics
+        signer.sign_many([SIGNATURE, SIGNATURES])
+        exported = metrics.as_dict()
+        self.assertEqual(exported['sign.calls'], 2)
+        self.assertEqual(exported['signatures'], 2)
+        self.assertEqual(exported['bytes_signed'],
+                         len(SIGNATURE) + len(SIGNATURES))
+        self.assertTrue(exported['digest.wall'] >= 0)
+
+        upload = StringIO()
+        extracted.make_signed('', upload, sigpath='zigbert',
+                              metrics=metrics)
+        self.assertEqual(metrics.stages['make_signed'][0], 2)
+        self.assertEqual(metrics.counters['bytes_written'],
+                         os.path.getsize(self.tmp_file('signed.zip'))
+                         + len(upload.getvalue()))
+
+    def test_39_inspect_signature(self):
+        with open(test_file('zigbert.test.pkcs7.der'), 'rb') as f:
+            der = f.read()
+        info = inspect_signature(der)
+        self.assertEqual(info.serial_number, 1421953342960)
+        self.assertTrue('CN=dev.addons.signing.root.ca' in info.issuer)
+        self.assertEqual(info.signing_time,
+                         datetime.datetime(2015, 1, 22, 19, 2, 22))
+        self.assertEqual(info.certificate.get_serial_number(), 1421953342960)
+        self.assertTrue(inspect_signature(der) is info)
+
+        inspector = SignatureInspector(maxsize=2)
+        ours = test_signer().sign_der(SIGNATURE)
+        other = test_signer().sign_der(SIGNATURES)
+        results = list(inspector.inspect_many([der, ours, 'garbage', der,
+                                               other, der]))
+        self.assertEqual([r[0].serial_number for r in results
+                          if r[0] is not None],
+                         [1421953342960, 500, 1421953342960, 500,
+                          1421953342960])
+        self.assertEqual(results[2][0], None)
+        self.assertTrue(isinstance(results[2][1], Exception))
+        self.assertEqual(results[1][0].issuer,
+                         '/O=Signing Clients Test/CN=signing-clients test root')
+        self.assertEqual(results[1][0].subject, '/O=Signing Clients Test'
+                         '/CN=signing-clients test signer')
+        self.assertTrue(results[1][0].signing_time is not None)
+        # der was used again before other came in, so it was kept
+        self.assertEqual((inspector.hits, inspector.misses), (2, 4))
+        self.assertEqual(list(inspect_signatures([ours]))[0][0]
+                         .serial_number, 500)
+
+    def test_40_cli(self):
+        indir = self.tmp_file('in')
+        outdir = self.tmp_file('out')
+        for relpath in ('a.xpi', 'nested/b.xpi', 'nested/deeper/c.xpi'):
+            dest = os.path.join(indir, relpath)
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            shutil.copy(test_file('test-jar.zip'), dest)
+        with open(os.path.join(indir, 'broken.xpi'), 'w') as f:
+            f.write('not a zip')
+        with open(os.path.join(indir, 'notes.txt'), 'w') as f:
+            f.write('not an archive either')
+        # Keep the progress reports out of the test output
+        self.addCleanup(setattr, sys, 'stdout', sys.stdout)
+        self.addCleanup(setattr, sys, 'stderr', sys.stderr)
+        sys.stdout = sys.stderr = StringIO()
+        argv = [indir, outdir, '--workers', '2',
+                '--key', test_file('test-signer.key.pem'),
+                '--chain', test_file('test-signer.cert.pem')]
+        self.assertEqual(cli.main(argv), 1)
+        for relpath in ('a.xpi', 'nested/b.xpi', 'nested/deeper/c.xpi'):
+            self.assertEqual(
+                JarVerifier(os.path.join(outdir, relpath)).verify(), 500)
+        self.assertFalse(os.path.exists(os.path.join(outdir, 'broken.xpi')))
+        self.assertEqual([name for name in os.listdir(outdir)
+                          if name.endswith('.tmp')], [])
+        log = os.path.join(outdir, '.signing-log')
+        self.assertEqual(cli.read_job_log(log),
+                         set(['a.xpi', 'nested/b.xpi', 'nested/deeper/c.xpi']))
+
+        # Resuming only retries what is not done yet, even after a crash
+        # cut the last line short
+        with open(log, 'a') as f:
+            f.write('{"path": "broken.x')
+        os.unlink(os.path.join(outdir, 'a.xpi'))
+        with open(os.path.join(indir, 'broken.xpi'), 'wb') as f:
+            with open(test_file('test-jar.zip'), 'rb') as jar:
+                f.write(jar.read())
+        self.assertEqual(cli.main(argv), 0)
+        self.assertFalse(os.path.exists(os.path.join(outdir, 'a.xpi')))
+        self.assertEqual(
+            JarVerifier(os.path.join(outdir, 'broken.xpi')).verify(), 500)
+
+        bad_key = self.tmp_file('bad.key.pem')
+        with open(bad_key, 'w') as f:
+            f.write('garbage')
+        sys.stderr = StringIO()
+        self.assertEqual(cli.main([indir, self.tmp_file('out2'),
+                                   '--key', bad_key,
+                                   '--chain', argv[-1]]), 1)
+        self.assertEqual(len(sys.stderr.getvalue().splitlines()), 1)
+
+    def test_41_compression_policy(self):
+        mixed = self.tmp_file('mixed.zip')
+        text = 'var x = 1;\n' * 1000
+        with ZipFile(mixed, 'w', zipfile.ZIP_DEFLATED) as zout:
+            zout.writestr('content/script.js', text)
+            zout.writestr('skin/icon.PNG', os.urandom(2000))
+            stored = zipfile.ZipInfo('content/stored.txt')
+            zout.writestr(stored, text)
+            zout.writestr('tiny.txt', 'x')
+        extracted = JarExtractor(mixed, ids='{}')
+        signature = test_signer().sign_der(extracted.signatures_text)
+
+        def signed(policy):
+            path = self.tmp_file('signed-%d.zip' % len(os.listdir(
+                self.tmpdir)))
+            extracted.make_signed(signature, path, sigpath='zigbert',
+                                  compression=policy)
+            self.assertEqual(JarVerifier(path).verify(), 500)
+            with ZipFile(path, 'r') as zin:
+                return dict((f.filename, f) for f in zin.infolist())
+        with ZipFile(mixed, 'r') as zin:
+            original = dict((f.filename, f) for f in zin.infolist())
+
+        kept = signed(compression.CompressionPolicy())
+        for name, f in original.items():
+            self.assertEqual((kept[name].compress_type,
+                              kept[name].compress_size),
+                             (f.compress_type, f.compress_size))
+        stored = signed(compression.CompressionPolicy(
+            default=compression.STORE))
+        for name in original:
+            self.assertEqual(stored[name].compress_type, zipfile.ZIP_STORED)
+        fast = signed(compression.FAST)
+        self.assertEqual(fast['skin/icon.PNG'].compress_size,
+                         original['skin/icon.PNG'].compress_size)
+        self.assertEqual(fast['content/stored.txt'].compress_type,
+                         zipfile.ZIP_DEFLATED)
+        # Deflating would only make it bigger
+        self.assertEqual(fast['tiny.txt'].compress_type, zipfile.ZIP_STORED)
+        best = signed(compression.MAX_RATIO)
+        self.assertTrue(best['content/script.js'].compress_size
+                        <= fast['content/script.js'].compress_size)
+        by_size = signed(compression.CompressionPolicy(
+            [compression.CompressionRule(compression.STORE, max_size=100),
+             compression.CompressionRule(6, ['*.js', '*.TXT'])]))
+        self.assertEqual(by_size['tiny.txt'].compress_type,
+                         zipfile.ZIP_STORED)
+        self.assertEqual(by_size['content/stored.txt'].compress_type,
+                         zipfile.ZIP_DEFLATED)
+        self.assertEqual(by_size['skin/icon.PNG'].compress_size,
+                         original['skin/icon.PNG'].compress_size)
+        self.assertRaises(ValueError, compression.CompressionRule, 10)
+
+    def test_42_compact_manifest(self):
+        for fname in ('test-jar.zip', 'test-jar-unicode.zip',
+                      'test-jar-long-path.zip'):
+            jar = test_file(fname)
+            plain = JarExtractor(jar, ids='{}', extra_newlines=True)
+            compact = JarExtractor(jar, ids='{}', extra_newlines=True,
+                                   compact=True)
+            self.assertTrue(isinstance(compact.manifest, CompactManifest))
+            self.assertTrue(isinstance(compact.signatures, CompactSignature))
+            self.assertEqual(compact.manifest_text, plain.manifest_text)
+            self.assertEqual(compact.signatures_text, plain.signatures_text)
+            self.assertEqual(len(compact.manifest), len(plain.manifest))
+            for mine, theirs in zip(compact.manifest, plain.manifest):
+                self.assertEqual((mine.name, mine.digests),
+                                 (theirs.name, theirs.digests))
+            self.assertEqual(compact.manifest[-1].name,
+                             plain.manifest[-1].name)
+
+            parsed = CompactManifest.parse(plain.manifest_text)
+            self.assertEqual(str(parsed),
+                             str(Manifest.parse(plain.manifest_text)))
+            self.assertEqual([str(i) for i in parsed[1:]],
+                             [str(i) for i in plain.manifest[1:]])
+            signature = CompactSignature.parse(plain.signatures_text)
+            self.assertEqual(signature.digest_manifests,
+                             plain.signatures.digest_manifests)
+        self.assertEqual(str(CompactManifest()), 'Manifest-Version: 1.0\n\n')
+
+        manifest = CompactManifest(['sha1'])
+        self.assertRaises(ValueError, manifest.append, 'a', {'md5': 'x'})
+        manifest.append('a', {'sha1': 'x' * 20})
+        self.assertRaises(ValueError, manifest.append, 'b', {'sha1': 'x'})
+        self.assertEqual(len(manifest), 1)
+        self.assertRaises(IndexError, manifest.__getitem__, 1)
+
+    def test_43_archive_scanner(self):
+        jar = test_file('test-jar.zip')
+        scan = ArchiveScanner().scan(jar)
+        self.assertEqual([f.filename for f in scan.members],
+                         ['test-file', 'test-dir/nested-test-file'])
+        reused = JarExtractor(jar, ids='{}', scan=scan)
+        self.assertEqual(reused.manifest_text,
+                         JarExtractor(jar, ids='{}').manifest_text)
+        checked = JarExtractor(jar, ids='{}', scanner=ArchiveScanner()).scan
+        self.assertEqual([(key, kind) for key, kind, _ in checked.index],
+                         [(key, kind) for key, kind, _ in scan.index])
+
+        self.assertRaises(ArchiveError, ArchiveScanner(max_entries=2).scan,
+                          jar)
+        self.assertRaises(ArchiveError, JarExtractor, jar,
+                          scanner=ArchiveScanner(max_entries=2))
+        with open(jar, 'rb') as f:
+            self.assertRaises(ArchiveError,
+                              ArchiveScanner(max_entries=2).scan, f.read())
+        self.assertRaises(ArchiveError,
+                          ArchiveScanner(max_total_size=10).scan, jar)
+        self.assertRaises(ArchiveError,
+                          ArchiveScanner(max_name_length=10).scan, jar)
+        ArchiveScanner(max_entries=None, max_total_size=None,
+                       max_name_length=None).scan(jar)
+
+        bomb = self.tmp_file('bomb.zip')
+        with ZipFile(bomb, 'w', zipfile.ZIP_DEFLATED) as zout:
+            zout.writestr('zeros', '\0' * ArchiveScanner.RATIO_MIN_SIZE)
+        self.assertRaises(ArchiveError, ArchiveScanner().scan, bomb)
+        ArchiveScanner(max_ratio=None).scan(bomb)
+
+        duplicates = self.tmp_file('duplicates.zip')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            with ZipFile(duplicates, 'w') as zout:
+                zout.writestr('a.js', 'one')
+                zout.writestr('a.js', 'two')
+        self.assertRaises(ArchiveError, ArchiveScanner().scan, duplicates)
+        ArchiveScanner(allow_duplicates=True).scan(duplicates)
+        # Only one of them could be matched to a manifest section
+        for scanner in (None, ArchiveScanner(allow_duplicates=True)):
+            self.assertRaises(ArchiveError, JarExtractor, duplicates,
+                              scanner=scanner)
+
+        # A central directory that understates how big a member is
+        liar = self.tmp_file('liar.zip')
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        data = compressor.compress('\0' * 100000) + compressor.flush()
+        zinfo = zipfile.ZipInfo('zeros')
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.file_size = 10
+        zinfo.CRC = 0
+        zinfo.compress_size = len(data)
+        with ZipFile(liar, 'w') as zout:
+            _write_member_raw(zout, zinfo, [data])
+        ArchiveScanner().scan(liar)
+        self.assertRaises(ArchiveError, JarExtractor, liar)
+        self.assertRaises(ArchiveError, JarExtractor, liar, memory_map=True)
+
+        # Directories are never digested, but make_signed() copies them
+        hidden = self.tmp_file('hidden.zip')
+        zinfo = zipfile.ZipInfo('d/')
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.file_size = zinfo.CRC = 0
+        zinfo.compress_size = len(data)
+        with ZipFile(hidden, 'w') as zout:
+            zout.writestr('a.js', 'var x = 1;\n')
+            _write_member_raw(zout, zinfo, [data])
+        self.assertRaises(ArchiveError, ArchiveScanner().scan, hidden)
+        self.assertRaises(ArchiveError, JarExtractor, hidden,
+                          scanner=ArchiveScanner())
+        extracted = JarExtractor(hidden)
+        for i, policy in enumerate([None, compression.MAX_RATIO]):
+            self.assertRaises(ArchiveError, extracted.make_signed, '',
+                              self.tmp_file('hidden-%d.zip' % i),
+                              sigpath='zigbert', compression=policy)
+
+    def test_44_lazy_m2crypto(self):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        out = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys, signing_clients.apps, signing_clients.cli; '
+             'print "M2Crypto" in sys.modules'], cwd=root)
+        self.assertEqual(out.strip(), 'False')
+
+        # The names apps has always imported from M2Crypto are still there,
+        # and are M2Crypto's own
+        from signing_clients import apps
+        from M2Crypto import BIO, Err, m2
+        from M2Crypto.SMIME import PKCS7
+        for name, expected in [
+                ('BIOError', BIO.BIOError), ('MemoryBuffer', MemoryBuffer),
+                ('SMIME', SMIME), ('PKCS7', PKCS7),
+                ('PKCS7_DETACHED', PKCS7_DETACHED),
+                ('PKCS7_BINARY', PKCS7_BINARY),
+                ('X509_Stack', X509.X509_Stack),
+                ('pkcs7_read_bio_der', m2.pkcs7_read_bio_der)]:
+            self.assertTrue(getattr(apps, name) is expected, name)
+        self.assertTrue(apps.Err.get_error is Err.get_error)
+
+    def test_45_signer_registry(self):
+        key = self.tmp_file('key.pem')
+        chain = self.tmp_file('chain.pem')
+        shutil.copy(test_file('test-signer.key.pem'), key)
+        shutil.copy(test_file('test-signer.cert.pem'), chain)
+        registry = SignerRegistry()
+        registry.register('test', key, chain)
+        self.assertEqual(registry.loads, 0)
+        self.assertEqual(registry.key_ids(), ['test'])
+        registry.warm()
+        self.assertEqual(registry.loads, 1)
+        signer = registry.get('test')
+        self.assertTrue(registry['test'] is signer)
+        self.assertEqual(registry.loads, 1)
+
+        extracted = JarExtractor(test_file('test-jar.zip'), ids='{}')
+        signed_file = self.tmp_file('signed.zip')
+        extracted.make_signed(signer.sign_der(extracted.signatures_text),
+                              signed_file, sigpath='zigbert')
+        self.assertEqual(JarVerifier(signed_file).verify(), 500)
+
+        # Replaced the way deployments do, by renaming over the old file
+        shutil.copy(test_file('test-signer.cert.pem'), chain + '.new')
+        os.rename(chain + '.new', chain)
+        self.assertFalse(registry.get('test') is signer)
+        self.assertEqual(registry.loads, 2)
+
+        registry.unregister('test')
+        self.assertFalse('test' in registry)
+        self.assertRaises(KeyError, registry.get, 'test')
+
+    def test_46_verify_long_path(self):
+        name = '/'.join(['nested-directory-%02d' % i for i in range(8)])
+        name += '/long-file-name.js'
+        self.assertTrue(len(name) > 140)
+        unsigned = self.tmp_file('long.zip')
+        with ZipFile(unsigned, 'w') as zout:
+            zout.writestr(name, 'var x = 1;\n')
+        extracted = JarExtractor(unsigned, ids='{}')
+        signed_file = self.tmp_file('signed.zip')
+        extracted.make_signed(
+            test_signer().sign_der(extracted.signatures_text), signed_file,
+            sigpath='zigbert')
+        self.assertEqual(JarVerifier(signed_file).verify(), 500)
+        self.assertEqual(Manifest.parse(extracted.manifest_text)[0].name,
+                         name)
+
+        # Consistently signed, but with a section that does not parse
+        mf = extracted.manifest_text.replace('Digest-Algorithms:',
+                                             'Bogus\nDigest-Algorithms:', 1)
+        sf = str(Signature([], digest_manifests={
+            'md5': hashlib.md5(mf).digest(),
+            'sha1': hashlib.sha1(mf).digest()}))
+        broken = self._rewrite(signed_file, 'broken.zip', {
+            'META-INF/manifest.mf': mf,
+            'META-INF/zigbert.sf': sf,
+            'META-INF/zigbert.rsa': test_signer().sign_der(sf)})
+        self.assertRaises(VerificationError, JarVerifier(broken).verify)
+
+    def test_47_verify_spaced_names(self):
+        # Spaces either side of where a name wraps, or at either end of it,
+        # are part of the name
+        names = ['a' * 66 + ' b.png', 'c' * 65 + ' d.png', 'e' * 66 + ' ',
+                 'sp ace ', ' lead']
+        unsigned = self.tmp_file('spaced.zip')
+        with ZipFile(unsigned, 'w') as zout:
+            for name in names:
+                zout.writestr(name, name)
+        extracted = JarExtractor(unsigned, ids='{}')
+        signed_file = self.tmp_file('signed.zip')
+        extracted.make_signed(
+            test_signer().sign_der(extracted.signatures_text), signed_file,
+            sigpath='zigbert')
+        self.assertEqual(JarVerifier(signed_file).verify(), 500)
+        expected = sorted(names + ['META-INF/ids.json'])
+        parsed = Manifest.parse(extracted.manifest_text)
+        self.assertEqual(sorted(section.name for section in parsed), expected)
+        self.assertEqual(sorted(LazyManifest(extracted.manifest_text).names()),
+                         expected)
+
+    def test_48_pipeline_stage_edges(self):
+        with SigningPipeline(FailingSigner()) as pipeline:
+            job = pipeline.submit(test_file('test-jar.zip'),
+                                  self.tmp_file('failed.zip'))
+            seen = []
+            job.add_done_callback(lambda job: seen.append(sorted(job.timings)))
+            self.assertRaises(ValueError, job.result)
+        # The failed stage is timed by the time anyone hears of the failure
+        self.assertEqual(seen, [['extract', 'queued', 'sign']])
+
+        out = BlockingStream()
+        self.addCleanup(out.release.set)
+        with SigningPipeline(test_signer()) as pipeline:
+            job = pipeline.submit(test_file('test-jar.zip'), out)
+            out.started.wait()
+            # Too late: the job is being written out
+            self.assertFalse(job.cancel())
+            out.release.set()
+            self.assertEqual(job.result(), out)
+        self.assertFalse(job.cancelled())
+        self.assertEqual(JarVerifier(StringIO(out.data.getvalue())).verify(),
+                         500)